@@ -0,0 +1,487 @@
+import asyncio
+import itertools
+import random
+import sys
+from typing import Any, Dict, Optional
+
+from client import subscription_options
+from codec import (
+    BINARY_CODEC,
+    DEFAULT_CODEC,
+    decode_envelope,
+    encode_envelope,
+    get_codec,
+)
+from framing import (
+    CHUNK_ABORT,
+    CHUNK_LAST,
+    FrameReader,
+    chunk_token,
+    encode_frame,
+    parse_chunk_token,
+)
+from transports import parse_url
+
+# cliente asyncio: publish não espera resposta (os frames de uma mesma volta do
+# loop saem num único write), mensagens chegam por "async for", e a conexão é
+# refeita com backoff exponencial reenviando HELLO e todas as inscrições.
+#
+#   async with AsyncClient(port=5000) as c:
+#       await c.subscribe("vehicle.+.telemetry")
+#       await c.publish("vehicle.1.telemetry", {"speed": 50})
+#       async for topic, payload in c:
+#           ...
+
+_CLOSED = object()
+
+
+class AsyncClient:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 5000,
+        protocol: int = 1,
+        codec: Optional[str] = None,
+        accept_codec: Optional[str] = None,
+        flow_control: bool = False,
+        reconnect: bool = True,
+        backoff: float = 0.1,
+        max_backoff: float = 5.0,
+        hello_timeout: float = 1.0,
+        high_water: int = 1024 * 1024,
+        url: Optional[str] = None,
+        chunk_size: int = 0,
+        queue_size: int = 1000,
+    ) -> None:
+        # url (tcp:// ou unix://) substitui host/porta; corpos maiores que
+        # chunk_size (ou que o max= anunciado pelo broker) saem em fragmentos.
+        # Com queue_size mensagens esperando o "async for" a leitura para e o
+        # TCP segura o broker
+        self._host = host
+        self._port = port
+        self._unix: Optional[str] = None
+        if url is not None:
+            scheme, address = parse_url(url)
+            if scheme == "tcp":
+                self._host, self._port = address
+            elif scheme == "unix":
+                self._unix = address
+            else:
+                raise ValueError(f"{scheme}:// não é suportado pelo AsyncClient")
+        self._protocol = protocol
+        # sem codec: msgpack quando a conexão fica no protocolo 2, JSON no 1
+        self._codec_option = get_codec(codec).name if codec else None
+        self._codec = self._codec_option or DEFAULT_CODEC
+        if accept_codec is not None:
+            get_codec(accept_codec)
+        self._accept_codec = accept_codec
+        self._flow_control = flow_control
+        self._reconnect = reconnect
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._hello_timeout = hello_timeout
+        # acima disso (bytes pendentes no transporte) o publish espera o drain
+        self._high_water = high_water
+        # chunk_size pedido e o efetivo na conexão atual (limitado pelo max=)
+        self._max_chunk = chunk_size
+        self._chunk_size = chunk_size
+        self._stream_ids = itertools.count(1)
+
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._binary = False
+        self._ready = asyncio.Event()
+        self._closing = False
+        self._reader_task: Optional["asyncio.Task[None]"] = None
+        self._reconnect_task: Optional["asyncio.Task[None]"] = None
+        # incrementa a cada conexão: ACK de uma conexão antiga não vale na nova
+        self._generation = 0
+
+        # frames da volta atual do loop, escritos juntos em _flush
+        self._out: list[bytes] = []
+        self._out_size = 0
+        self._flush_scheduled = False
+
+        # tópico -> opções do SUB, reenviadas a cada reconexão
+        self._subs: Dict[str, Dict[str, Any]] = {}
+        self._inbox: "asyncio.Queue[Any]" = asyncio.Queue(max(1, queue_size))
+        # fim do "async for"; o _CLOSED pode não caber na fila cheia
+        self._eof = False
+        self._pending_ack: Optional[tuple[int, int]] = None
+        # mensagens fragmentadas (CHUNK) sendo remontadas e o próximo seq
+        # esperado, por stream
+        self._partial: Dict[int, list[bytes]] = {}
+        self._chunk_seq: Dict[int, int] = {}
+
+        self._credits: Optional[int] = None
+        self._credit_cond = asyncio.Condition()
+
+    async def __aenter__(self) -> "AsyncClient":
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self.close()
+
+    @property
+    def connected(self) -> bool:
+        return self._ready.is_set() and not self._closing
+
+    @property
+    def protocol(self) -> int:
+        return 2 if self._binary else 1
+
+    async def connect(self) -> None:
+        await self._open()
+
+    async def _open(self) -> None:
+        if self._unix is not None:
+            reader, writer = await asyncio.open_unix_connection(self._unix)
+        else:
+            reader, writer = await asyncio.open_connection(self._host, self._port)
+        frames = FrameReader()
+        try:
+            await self._negotiate(reader, writer, frames)
+        except (OSError, ConnectionError):
+            writer.close()
+            raise
+        self._generation += 1
+        self._writer = writer
+        # streams da conexão anterior não terminam mais
+        self._partial.clear()
+        self._chunk_seq.clear()
+        self._out.clear()
+        self._out_size = 0
+        for topic, options in self._subs.items():
+            self._write_sub(topic, options)
+        self._flush()
+        self._reader_task = asyncio.ensure_future(self._read_loop(reader, frames))
+        self._ready.set()
+        # quem esperava crédito da conexão anterior reavalia com o saldo novo
+        async with self._credit_cond:
+            self._credit_cond.notify_all()
+
+    async def _negotiate(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        frames: FrameReader,
+    ) -> None:
+        self._binary = False
+        self._codec = self._codec_option or DEFAULT_CODEC
+        self._credits = None
+        self._chunk_size = self._max_chunk
+        # HELLO sempre, mesmo no protocolo 1: é por ele que chega o max=;
+        # broker antigo não responde ao HELLO: seguimos no protocolo de texto
+        line = f"HELLO {self._protocol}"
+        if self._accept_codec is not None:
+            line += f" codec={self._accept_codec}"
+        if self._flow_control:
+            line += " flow=1"
+        writer.write(f"{line}\n".encode("utf-8"))
+        await writer.drain()
+        try:
+            frame = await asyncio.wait_for(
+                self._first_frame(reader, frames), self._hello_timeout
+            )
+        except asyncio.TimeoutError:
+            return
+        parts = frame[0]
+        if parts[0].upper() != "HELLO" or len(parts) < 2:
+            return
+        if int(parts[1]) >= 2:
+            self._binary = True
+            self._codec = self._codec_option or BINARY_CODEC
+            frames.binary = True
+        for token in parts[2:]:
+            key, _, value = token.partition("=")
+            if key == "credits":
+                self._credits = int(value)
+            elif key == "max":
+                limit = int(value)
+                if not self._chunk_size or limit < self._chunk_size:
+                    self._chunk_size = limit
+
+    @staticmethod
+    async def _first_frame(
+        reader: asyncio.StreamReader, frames: FrameReader
+    ) -> tuple[list[str], bytes]:
+        while True:
+            frame = next(frames.frames(), None)
+            if frame is not None:
+                return frame
+            data = await reader.read(65536)
+            if not data:
+                raise ConnectionError("broker fechou a conexão no HELLO")
+            frames.feed(data)
+
+    async def _read_loop(
+        self, reader: asyncio.StreamReader, frames: FrameReader
+    ) -> None:
+        generation = self._generation
+        try:
+            while True:
+                for parts, body in frames.frames():
+                    item = self._on_frame(parts, body, generation)
+                    if item is not None:
+                        await self._inbox.put(item)
+                data = await reader.read(65536)
+                if not data:
+                    break
+                frames.feed(data)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._connection_lost()
+
+    def _on_frame(
+        self, parts: list[Any], body: bytes, generation: int
+    ) -> Optional[tuple[str, Any, Optional[tuple[int, int]]]]:
+        # devolve a mensagem para o inbox (o _read_loop espera ter espaço)
+        cmd = parts[0].upper()
+        if cmd == "MSG" and len(parts) >= 2:
+            codec = parts[3] if len(parts) > 3 else DEFAULT_CODEC
+            obj = self._decode(parts[1], body, codec)
+            if obj is None:
+                # sem ACK; a conexão segue
+                return None
+            ack = (generation, parts[4]) if len(parts) > 4 else None
+            return parts[1], obj.get("payload"), ack
+        elif cmd == "CHUNK" and len(parts) >= 5:
+            stream, seq, flags = parse_chunk_token(parts[4])
+            expected = self._chunk_seq.pop(stream, 0)
+            if flags & CHUNK_ABORT or seq != expected:
+                # abandonado, ou fragmento perdido: não há como remontar
+                self._partial.pop(stream, None)
+                return None
+            self._partial.setdefault(stream, []).append(body)
+            if not flags & CHUNK_LAST:
+                self._chunk_seq[stream] = seq + 1
+            else:
+                body = b"".join(self._partial.pop(stream))
+                obj = self._decode(parts[1], body, parts[3])
+                if obj is not None:
+                    return parts[1], obj.get("payload"), None
+        elif cmd == "CREDIT" and len(parts) >= 2:
+            asyncio.ensure_future(self._add_credits(int(parts[1])))
+        return None
+
+    @staticmethod
+    def _decode(topic: str, body: bytes, codec: str) -> Optional[dict]:
+        # o broker em pass-through não valida o corpo: o que não decodifica é
+        # descartado aqui, sem derrubar a conexão
+        try:
+            return decode_envelope(body, codec)
+        except ValueError as exc:
+            print(f"mensagem inválida em {topic} descartada: {exc}", file=sys.stderr)
+            return None
+
+    def _connection_lost(self) -> None:
+        self._ready.clear()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._out.clear()
+        self._out_size = 0
+        if self._closing or not self._reconnect:
+            self._put_closed()
+            return
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.ensure_future(self._reconnect_loop())
+
+    def _put_closed(self) -> None:
+        # com a fila cheia o __anext__ vê _eof quando ela esvaziar
+        self._eof = True
+        if not self._inbox.full():
+            self._inbox.put_nowait(_CLOSED)
+
+    async def _reconnect_loop(self) -> None:
+        delay = self._backoff
+        while not self._closing:
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            try:
+                await self._open()
+                return
+            except OSError:
+                delay = min(delay * 2, self._max_backoff)
+
+    async def _wait_ready(self) -> None:
+        if not self._ready.is_set():
+            await self._ready.wait()
+        # close() também solta quem estava esperando a reconexão
+        if self._closing:
+            raise ConnectionError("cliente fechado")
+
+    def _write(self, frame: bytes) -> None:
+        self._out.append(frame)
+        self._out_size += len(frame)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+
+    def _flush(self) -> None:
+        self._flush_scheduled = False
+        if not self._out or self._writer is None:
+            return
+        data = b"".join(self._out)
+        self._out.clear()
+        self._out_size = 0
+        self._writer.write(data)
+
+    async def _drain_if_needed(self) -> None:
+        writer = self._writer
+        if writer is None:
+            return
+        pending = self._out_size + writer.transport.get_write_buffer_size()
+        if pending < self._high_water:
+            return
+        self._flush()
+        try:
+            await writer.drain()
+        except ConnectionError:
+            # a leitura percebe a queda e reconecta
+            pass
+
+    async def _add_credits(self, n: int) -> None:
+        async with self._credit_cond:
+            self._credits = (self._credits or 0) + n
+            self._credit_cond.notify_all()
+
+    async def _take_credit(self) -> None:
+        async with self._credit_cond:
+            while self._credits is not None and self._credits <= 0:
+                if self._closing:
+                    raise ConnectionError("cliente fechado")
+                await self._credit_cond.wait()
+            if self._credits is not None:
+                self._credits -= 1
+
+    async def publish(
+        self, topic: str, payload: Any, codec: Optional[str] = None
+    ) -> None:
+        codec = get_codec(codec).name if codec else self._codec
+        data = encode_envelope(payload, None, codec)
+        await self._wait_ready()
+        if self._chunk_size and len(data) > self._chunk_size:
+            await self._publish_chunks(topic, data, codec)
+            return
+        if self._credits is not None:
+            await self._take_credit()
+            await self._wait_ready()
+        self._write(encode_frame("PUB", topic, data, self._binary, codec))
+        await self._drain_if_needed()
+
+    async def _publish_chunks(self, topic: str, data: bytes, codec: str) -> None:
+        # como no Client, fragmentos não consomem créditos. Se a conexão cair
+        # no meio o broker abandona o stream; o corpo inteiro sai de novo na
+        # conexão seguinte, com outro stream
+        view = memoryview(data)
+        while True:
+            await self._wait_ready()
+            generation = self._generation
+            size = self._chunk_size or len(data)
+            stream = next(self._stream_ids)
+            last = (len(data) - 1) // size
+            for seq in range(last + 1):
+                if self._generation != generation or not self._ready.is_set():
+                    break
+                flags = CHUNK_LAST if seq == last else 0
+                chunk = view[seq * size : (seq + 1) * size]
+                token = chunk_token(stream, seq, flags)
+                self._write(
+                    encode_frame("CHUNK", topic, chunk, self._binary, codec, token)
+                )
+                await self._drain_if_needed()
+            else:
+                return
+
+    async def subscribe(
+        self,
+        topic: str,
+        offset: Optional[int] = None,
+        since: Optional[float] = None,
+        qos: int = 0,
+        window: Optional[int] = None,
+        group: Optional[str] = None,
+        balance: Optional[str] = None,
+        filter: Optional[str] = None,
+        conflate: Optional[str] = None,
+    ) -> None:
+        options = dict(
+            offset=offset,
+            since=since,
+            qos=qos,
+            window=window,
+            group=group,
+            balance=balance,
+            filter=filter,
+            conflate=conflate,
+        )
+        if self._ready.is_set():
+            self._write_sub(topic, options)
+        # replay (offset/since) só na primeira vez; reconexões seguem ao vivo
+        self._subs[topic] = dict(options, offset=None, since=None)
+        await self._drain_if_needed()
+
+    async def unsubscribe(self, topic: str) -> None:
+        options = self._subs.pop(topic, None)
+        if options is None or not self._ready.is_set():
+            return
+        group = options.get("group")
+        body = f"group={group}".encode("utf-8") if group is not None else b""
+        self._write(encode_frame("UNSUB", topic, body, self._binary))
+
+    def _write_sub(self, topic: str, options: Dict[str, Any]) -> None:
+        body = " ".join(subscription_options(**options)).encode("utf-8")
+        self._write(encode_frame("SUB", topic, body, self._binary))
+
+    async def flush(self) -> None:
+        await self._wait_ready()
+        self._flush()
+        if self._writer is not None:
+            try:
+                await self._writer.drain()
+            except ConnectionError:
+                pass
+
+    def __aiter__(self) -> "AsyncClient":
+        return self
+
+    async def __anext__(self) -> tuple[str, Any]:
+        # a mensagem anterior foi processada: confirma (qos=1) antes da próxima
+        if self._pending_ack is not None:
+            generation, msg_id = self._pending_ack
+            self._pending_ack = None
+            if generation == self._generation and self._ready.is_set():
+                self._write(encode_frame("ACK", str(msg_id), binary=self._binary))
+        if self._eof and self._inbox.empty():
+            raise StopAsyncIteration
+        item = await self._inbox.get()
+        if item is _CLOSED:
+            self._inbox.put_nowait(_CLOSED)
+            raise StopAsyncIteration
+        topic, payload, ack = item
+        self._pending_ack = ack
+        return topic, payload
+
+    async def close(self) -> None:
+        self._closing = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        self._flush()
+        writer = self._writer
+        if writer is not None:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+            # a leitura pode estar parada no inbox cheio (ninguém mais consome):
+            # cancela em vez de esperar o EOF; o finally dela encerra o "async for"
+            if self._reader_task is not None:
+                self._reader_task.cancel()
+                await asyncio.gather(self._reader_task, return_exceptions=True)
+        else:
+            self._put_closed()
+        self._ready.set()
+        async with self._credit_cond:
+            self._credit_cond.notify_all()
@@ -0,0 +1,309 @@
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from broker import Broker
+from client import Client
+
+# benchmark de vazão/latência: sobe um Broker local e mede msgs/s, MB/s e
+# percentis de latência ponta a ponta (publish -> callback do subscriber).
+#
+#   python bench.py --publishers 2 --subscribers 4 --topics 8 --fanout 2 \
+#       --messages 20000 --payload 256 --mode selector --repeat 3 -o out.json
+#
+# A saída em JSON (stdout ou -o) traz configuração, ambiente e cada rodada,
+# para comparar execuções. Publicadores e subscribers são threads deste mesmo
+# processo: os números incluem a disputa pelo GIL com o broker.
+
+_STAMP = struct.Struct("!dI")
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            timeout=5,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def _percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[idx]
+
+
+class _Payloads:
+    # carimbo de tempo + sequência; o resto é enchimento até o tamanho pedido
+    def __init__(self, codec: str, size: int) -> None:
+        self.codec = codec
+        self._pad = max(0, size - _STAMP.size)
+
+    def make(self, seq: int) -> Any:
+        now = time.perf_counter()
+        if self.codec == "raw":
+            return _STAMP.pack(now, seq) + b"x" * self._pad
+        return {"t": now, "seq": seq, "pad": "x" * self._pad}
+
+    def sent_at(self, payload: Any) -> float:
+        if self.codec == "raw":
+            return _STAMP.unpack_from(payload)[0]
+        return payload["t"]
+
+    @staticmethod
+    def is_marker(topic: str) -> bool:
+        return topic.endswith(".warm")
+
+
+class _Subscriber:
+    def __init__(
+        self, args: argparse.Namespace, port: int, topics: List[str]
+    ) -> None:
+        self.topics = topics
+        self.latencies: List[float] = []
+        # tópicos cujo marcador de aquecimento já chegou
+        self.ready: Set[str] = set()
+        self.last_receive = 0.0
+        self._payloads = _Payloads(args.codec, args.payload)
+        self._client = Client(
+            port=port, protocol=args.protocol, accept_codec=args.accept_codec
+        )
+        for topic in topics:
+            self._client.subscribe(topic)
+            # marcador por tópico: sinaliza que a inscrição já vale no broker
+            self._client.subscribe(f"{topic}.warm")
+        t = threading.Thread(target=self._client.listen, args=(self._on,), daemon=True)
+        t.start()
+
+    def _on(self, topic: str, payload: Any) -> None:
+        now = time.perf_counter()
+        if _Payloads.is_marker(topic):
+            self.ready.add(topic)
+            return
+        self.latencies.append(now - self._payloads.sent_at(payload))
+        self.last_receive = now
+
+    def close(self) -> None:
+        self._client.close()
+
+
+def _publish(
+    args: argparse.Namespace,
+    port: int,
+    topics: List[str],
+    seed: int,
+    start: threading.Event,
+    sent: List[int],
+    index: int,
+) -> None:
+    client = Client(
+        port=port,
+        protocol=args.protocol,
+        codec=args.codec,
+        batch_size=args.batch,
+        linger=args.linger,
+    )
+    payloads = _Payloads(args.codec, args.payload)
+    rng = random.Random(seed)
+    interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    start.wait()
+    begin = time.perf_counter()
+    for seq in range(args.messages):
+        if interval:
+            delay = begin + seq * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        client.publish(rng.choice(topics), payloads.make(seq))
+        sent[index] += 1
+    client.flush()
+    client.close()
+
+
+def _assign(args: argparse.Namespace, topics: List[str]) -> List[List[str]]:
+    # cada tópico é assinado por exatamente `fanout` subscribers
+    assigned: List[List[str]] = [[] for _ in range(args.subscribers)]
+    for i, topic in enumerate(topics):
+        for r in range(args.fanout):
+            assigned[(i * args.fanout + r) % args.subscribers].append(topic)
+    return assigned
+
+
+def run_once(args: argparse.Namespace, port: int, run: int) -> Dict[str, Any]:
+    topics = [f"bench.{run}.t{i}" for i in range(args.topics)]
+    subs = [_Subscriber(args, port, t) for t in _assign(args, topics)]
+
+    # aquecimento: espera cada subscriber receber o marcador de cada tópico
+    warm = Client(port=port, protocol=args.protocol)
+    deadline = time.monotonic() + args.timeout
+    while any(len(s.ready) < len(s.topics) for s in subs):
+        if time.monotonic() > deadline:
+            raise RuntimeError("subscribers não ficaram prontos a tempo")
+        for topic in topics:
+            warm.publish(f"{topic}.warm", 0)
+        time.sleep(0.1)
+    warm.close()
+
+    start = threading.Event()
+    sent = [0] * args.publishers
+    pubs = [
+        threading.Thread(
+            target=_publish,
+            args=(args, port, topics, args.seed + run * 1000 + i, start, sent, i),
+            daemon=True,
+        )
+        for i in range(args.publishers)
+    ]
+    for t in pubs:
+        t.start()
+    time.sleep(0.2)
+    t0 = time.perf_counter()
+    start.set()
+
+    expected = args.publishers * args.messages * args.fanout
+    last_count, last_progress = -1, time.monotonic()
+    while True:
+        received = sum(len(s.latencies) for s in subs)
+        if received >= expected:
+            break
+        if received != last_count:
+            last_count, last_progress = received, time.monotonic()
+        elif time.monotonic() - last_progress > args.timeout:
+            # mensagens perdidas (política de overflow com descarte, por exemplo)
+            break
+        time.sleep(0.01)
+    for t in pubs:
+        t.join()
+    end = max((s.last_receive for s in subs), default=t0)
+    duration = max(end - t0, 1e-9)
+
+    latencies = sorted(x for s in subs for x in s.latencies)
+    for s in subs:
+        s.close()
+    received = len(latencies)
+    delivered_bytes = received * args.payload
+    result: Dict[str, Any] = {
+        "run": run,
+        "sent": sum(sent),
+        "expected": expected,
+        "received": received,
+        "lost": expected - received,
+        "duration_s": duration,
+        "msgs_per_s": received / duration,
+        "mb_per_s": delivered_bytes / duration / 1e6,
+        "publish_msgs_per_s": sum(sent) / duration,
+        "latency_us": {
+            name: (None if v is None else v * 1e6)
+            for name, v in (
+                ("p50", _percentile(latencies, 0.5)),
+                ("p90", _percentile(latencies, 0.9)),
+                ("p99", _percentile(latencies, 0.99)),
+                ("p999", _percentile(latencies, 0.999)),
+                ("max", latencies[-1] if latencies else None),
+            )
+        },
+    }
+    return result
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="benchmark de vazão/latência do broker")
+    p.add_argument("--mode", choices=Broker.MODES, default="threads")
+    p.add_argument("--consumers", type=int, default=1)
+    p.add_argument("--outbox-size", type=int, default=1000)
+    p.add_argument("--overflow", default="block")
+    p.add_argument("--passthrough", action="store_true")
+    p.add_argument("--publishers", type=int, default=1)
+    p.add_argument("--subscribers", type=int, default=1)
+    p.add_argument("--topics", type=int, default=1)
+    p.add_argument("--fanout", type=int, default=1, help="subscribers por tópico")
+    p.add_argument("--messages", type=int, default=10000, help="por publicador")
+    p.add_argument("--payload", type=int, default=128, help="bytes de payload")
+    p.add_argument("--rate", type=float, default=0.0, help="msgs/s por publicador")
+    p.add_argument("--batch", type=int, default=1)
+    p.add_argument("--linger", type=float, default=0.0)
+    p.add_argument("--protocol", type=int, default=1)
+    p.add_argument("--codec", default="json")
+    p.add_argument("--accept-codec", default=None)
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--timeout", type=float, default=10.0)
+    p.add_argument("-o", "--output", default=None, help="arquivo JSON de saída")
+    args = p.parse_args(argv)
+    if not 1 <= args.fanout <= args.subscribers:
+        p.error("--fanout precisa estar entre 1 e --subscribers")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    args = parse_args(argv)
+    port = _free_port()
+    broker = Broker(
+        port=port,
+        mode=args.mode,
+        outbox_size=args.outbox_size,
+        overflow=args.overflow,
+        passthrough=args.passthrough,
+        consumers=args.consumers,
+    )
+    threading.Thread(target=broker.start, daemon=True).start()
+    time.sleep(0.3)
+
+    runs = []
+    for run in range(args.repeat):
+        result = run_once(args, port, run)
+        runs.append(result)
+        lat = result["latency_us"]
+        print(
+            f"[bench] run {run}: {result['msgs_per_s']:.0f} msgs/s "
+            f"{result['mb_per_s']:.2f} MB/s p50={lat['p50'] or 0:.0f}us "
+            f"p99={lat['p99'] or 0:.0f}us p999={lat['p999'] or 0:.0f}us "
+            f"perdidas={result['lost']}",
+            file=sys.stderr,
+        )
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "env": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "commit": _git_commit(),
+            "time": time.time(),
+        },
+        "runs": runs,
+        "broker": {
+            k: v for k, v in broker.stats().items() if k in ("queues", "latency")
+        },
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
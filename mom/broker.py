@@ -1,101 +1,1335 @@
+import argparse
+import functools
+import itertools
+import json
+import selectors
 import socket
+import sys
 import threading
-from typing import Dict
+import time
+from typing import Any, Dict, Optional, Sequence
 
 from core import (
+    GROUP_STRATEGIES,
     Message,
     Marshaller,
     SubscriptionManager,
     NotificationEngine,
     NotificationConsumer,
+    InflightWindow,
+    Outbox,
+    RetainedCache,
+    Subscription,
+    SubscriberGroup,
 )
+from codec import CODECS_BY_ID, DEFAULT_CODEC, encode_envelope, get_codec
+from filters import Filter, compile_filter
+from framing import (
+    CHUNK_ABORT,
+    CHUNK_LAST,
+    PROTOCOL_VERSION,
+    EncodedMessage,
+    FrameReader,
+    chunk_token,
+    encode_frame,
+    iter_batch,
+    parse_chunk_token,
+)
+from metrics import Metrics
+from peers import PeerLink
+from storage import MessageStore
+from topics import matches, summarize
+from tracing import Tracer
+from transports import InprocSocket, listen, parse_url, register_inproc
+
+
+class _Connection:
+    def __init__(self, sock: socket.socket, outbox: Outbox, name: str = "") -> None:
+        self.sock = sock
+        # host:porta do cliente, rótulo das métricas da conexão
+        self.name = name
+        self.outbox = outbox
+        self.reader = FrameReader()
+        self.outbuf = bytearray()
+        self.closed = False
+        self.version = 1
+        # codec em que o cliente quer receber (None: o do publicador)
+        self.codec: Optional[str] = None
+        # enquanto há replay em andamento, frames ao vivo ficam retidos aqui
+        # (com id da mensagem, chave de conflação e instante de chegada)
+        self.held: Optional[list[tuple[bytes, Optional[int], Any, float, Any]]] = None
+        self.holds = 0
+        self.lock = threading.Lock()
+        # SUB com qos=1: mensagens ao vivo só saem da janela com ACK
+        self.window: Optional[InflightWindow] = None
+        # publicador com controle de fluxo e créditos já consumidos (a devolver)
+        self.flow = False
+        self.owed = 0
+        # link de outro broker (PEER): não conta como interesse local
+        self.peer = False
+        # cliente no mesmo processo: o outbox guarda EncodedMessage, não frames
+        self.inproc = False
+        # streams (CHUNK) abertos por este publicador: id do cliente ->
+        # (id global, tópico, codec, destinos escolhidos no primeiro fragmento)
+        self.streams: Dict[int, tuple[int, str, str, list["_Connection"]]] = {}
+        # política "block" no modo selector: publicador com a leitura parada
+        # e, no inscrito, os publicadores esperando o outbox dele esvaziar
+        self.paused = False
+        self.waiters: set["_Connection"] = set()
 
 
 class Broker:
-    def __init__(self, host: str = "127.0.0.1", port: int = 5000) -> None:
+    MODES = ("threads", "selector")
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 5000,
+        mode: str = "threads",
+        outbox_size: int = 1000,
+        overflow: str = "block",
+        passthrough: bool = False,
+        consumers: int = 1,
+        log_dir: Optional[str] = None,
+        retain_topics: int = 0,
+        retain_bytes: int = 64 * 1024 * 1024,
+        ack_timeout: float = 5.0,
+        ack_window: int = 100,
+        publish_credits: int = 0,
+        max_queued: int = 10000,
+        group_strategy: str = "round_robin",
+        stats_interval: float = 0.0,
+        stats_file: Optional[str] = None,
+        reuse_port: bool = False,
+        peer_path: Optional[str] = None,
+        peers: Sequence[str] = (),
+        node: Optional[str] = None,
+        peer_interest_limit: int = 1000,
+        listen: Sequence[str] = (),
+        trace_rate: float = 0.0,
+        trace_file: str = "mom-trace.json",
+        trace_max_bytes: int = 64 * 1024 * 1024,
+        max_message: int = 0,
+    ) -> None:
+        if mode not in self.MODES:
+            raise ValueError(f"modo de broker desconhecido: {mode}")
+        if group_strategy not in GROUP_STRATEGIES:
+            raise ValueError(f"estratégia de grupo desconhecida: {group_strategy}")
         self._host = host
         self._port = port
+        self._mode = mode
+        self._outbox_size = outbox_size
+        self._overflow = overflow
+        self._passthrough = passthrough
+        self._ack_timeout = ack_timeout
+        self._ack_window = ack_window
+        # créditos iniciais de cada publicador com flow=1 (0 desliga o controle);
+        # novos créditos só saem enquanto o engine tem menos de max_queued
+        self._publish_credits = publish_credits
+        self._max_queued = max_queued
+        self._msg_ids = itertools.count(1)
+        # corpo acima de max_message (0: o limite padrão do FrameReader) derruba
+        # o publicador antes de ser lido; mensagens maiores vão em fragmentos (CHUNK), repassados
+        # aos inscritos conforme chegam, sem passar pelo engine nem pelo log
+        self._max_message = max_message
+        self._stream_ids = itertools.count(1)
+        # padrão para "SUB topic group=g"; o primeiro membro pode trocar com balance=
+        self._group_strategy = group_strategy
+        Outbox(outbox_size, overflow)  # valida a política já na construção
+
+        # métricas sempre ligadas; STATS devolve um snapshot e, com
+        # stats_interval > 0, um snapshot é gravado em stats_file (ou no stdout)
+        self._metrics = Metrics()
+        self._outbox_wait = self._metrics.histogram("outbox_wait")
+        self._end_to_end = self._metrics.histogram("end_to_end")
+        self._stats_interval = stats_interval
+        self._stats_file = stats_file
+        # trace_rate > 0: essa fração das mensagens tem cada estágio rastreado
+        # em trace_file (rotativo) e nos histogramas stage.* do STATS
+        self._tracer = (
+            Tracer(trace_rate, trace_file, trace_max_bytes, metrics=self._metrics)
+            if trace_rate > 0
+            else None
+        )
+        self._started = time.time()
+        # endereços extras além de host:porta, ex.: unix:///tmp/mom.sock, inproc://bus
+        for url in listen:
+            parse_url(url)
+        self._listen = tuple(listen)
+        self._inproc_ids = itertools.count(1)
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # vários processos no mesmo host:porta; o kernel divide as conexões
+            if not hasattr(socket, "SO_REUSEPORT"):
+                raise ValueError("SO_REUSEPORT não suportado nesta plataforma")
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
 
-        self._subs = SubscriptionManager()
-        self._engine = NotificationEngine()
+        # links com outros brokers: peer_path recebe os links de entrada (socket
+        # Unix) e peers são os endereços ("host:porta" ou caminho Unix) aos quais
+        # este broker se liga; a malha precisa ser completa (cada nó lista todos
+        # os outros), já que mensagens repassadas não seguem adiante. Cada link
+        # anuncia no máximo peer_interest_limit padrões (resumidos com curingas)
+        self._node = node or f"{host}:{port}"
+        self._peer_interest_limit = peer_interest_limit
+        self._peer_path = peer_path
+        self._links = [
+            PeerLink(a, self._node, self._relay, self._relay_chunk) for a in peers
+        ]
+        self._peer_socks: set[socket.socket] = set()
+        # SUB/UNSUB/quedas só marcam; o thread de manutenção recalcula
+        self._interest_changed = threading.Event()
 
-        self._consumer = NotificationConsumer(
-            self._engine,
-            self._subs.get,
-            self._send_to_client,
+        self._subs = SubscriptionManager(load_fn=self._load)
+        self._engine = NotificationEngine(shards=consumers)
+        self._store = MessageStore(log_dir) if log_dir else None
+        self._retained = (
+            RetainedCache(retain_topics, retain_bytes) if retain_topics > 0 else None
         )
-        self._consumer.start()
 
-        self._clients: Dict[socket.socket, socket.socket] = {}
+        self._consumers = [
+            NotificationConsumer(
+                self._engine,
+                self._subs.get,
+                self._send_to_client,
+                encode_fn=self._encode_frame,
+                shard=i,
+                retain_fn=self._retained.put if self._retained is not None else None,
+                get_filters=self._subs.filter_index,
+            )
+            for i in range(consumers)
+        ]
+        for consumer in self._consumers:
+            consumer.start()
+
+        self._clients: Dict[socket.socket, _Connection] = {}
+
+        # usados só no modo selector: o consumer acorda o loop pelo socketpair
+        self._selector: Optional[selectors.BaseSelector] = None
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._dirty: set[_Connection] = set()
+        self._dirty_lock = threading.Lock()
+        self._loop_thread: Optional[threading.Thread] = None
+
+        # publicadores sem crédito esperando o engine esvaziar
+        self._starved: set[_Connection] = set()
+        self._starved_lock = threading.Lock()
+        m = threading.Thread(target=self._maintain, daemon=True)
+        m.start()
 
     def start(self) -> None:
         self._sock.bind((self._host, self._port))
         self._sock.listen()
-        print(f"Broker escutando em {self._host}:{self._port}")
+        # avisos vão para stderr: stdout fica para os dados (estatísticas,
+        # relatório do bench)
+        print(
+            f"Broker escutando em {self._host}:{self._port} (modo {self._mode})",
+            file=sys.stderr,
+        )
+        listeners = [self._sock]
+        for url in self._listen:
+            scheme, address = parse_url(url)
+            if scheme == "inproc":
+                register_inproc(address, self)
+            else:
+                listeners.append(listen(url))
+            print(f"Broker escutando em {url}", file=sys.stderr)
+        if self._peer_path is not None:
+            listeners.append(listen(f"unix://{self._peer_path}"))
+        for link in self._links:
+            link.start()
 
+        if self._mode == "selector":
+            self._serve_selector(listeners)
+        else:
+            for listener in listeners[1:]:
+                t = threading.Thread(
+                    target=self._serve_threads, args=(listener,), daemon=True
+                )
+                t.start()
+            self._serve_threads(self._sock)
+
+    def _serve_threads(self, listener: socket.socket) -> None:
         while True:
-            client_sock, addr = self._sock.accept()
-            print("Nova conexão de", addr)
-            self._clients[client_sock] = client_sock
+            client_sock, addr = listener.accept()
+            print("Nova conexão de", addr, file=sys.stderr)
+            conn = self._new_connection(client_sock, addr)
             t = threading.Thread(
                 target=self._handle_client,
                 args=(client_sock,),
+                name=f"reader {conn.name}",
                 daemon=True,
             )
             t.start()
+            w = threading.Thread(
+                target=self._write_loop,
+                args=(conn,),
+                name=f"writer {conn.name}",
+                daemon=True,
+            )
+            w.start()
+
+    def _new_connection(self, client_sock: socket.socket, addr: Any) -> _Connection:
+        outbox = Outbox(self._outbox_size, self._overflow, self._observe_send)
+        if isinstance(addr, tuple):
+            name = f"{addr[0]}:{addr[1]}"
+        elif addr:
+            name = str(addr)
+        else:
+            # socket Unix: o cliente não tem endereço
+            name = f"unix:{client_sock.fileno()}"
+        conn = _Connection(client_sock, outbox, name)
+        if self._max_message > 0:
+            conn.reader.max_body = self._max_message
+        self._clients[client_sock] = conn
+        return conn
+
+    def _observe_send(
+        self, waited: float, origin: float, trace: Any, tag: Any
+    ) -> None:
+        # chamado quando um frame sai do outbox para o socket; tag: os
+        # contadores de saída dele (descartados e substituídos não contam)
+        if tag is not None:
+            self._metrics.counters.add_all(tag)
+        self._outbox_wait.observe(waited)
+        now = time.monotonic()
+        if origin:
+            self._end_to_end.observe(now - origin)
+        if trace is not None:
+            trace.span("outbox", now - waited, now)
+
+    def _write_loop(self, conn: _Connection) -> None:
+        while True:
+            frame = conn.outbox.get()
+            if frame is None:
+                return
+            frames = [frame] + conn.outbox.drain(63)
+            try:
+                if self._tracer is not None and self._tracer.sampled():
+                    start = time.monotonic()
+                    data = b"".join(frames)
+                    conn.sock.sendall(data)
+                    self._tracer.span(
+                        "sendall",
+                        start,
+                        time.monotonic(),
+                        args={"bytes": len(data), "frames": len(frames)},
+                    )
+                else:
+                    conn.sock.sendall(b"".join(frames))
+            except OSError:
+                # conexão quebrada; o leitor cuida da limpeza
+                self._metrics.counters.add(("broker.send_errors", ""))
+                conn.outbox.close()
+                return
 
     def _handle_client(self, client_sock: socket.socket) -> None:
-        buf = b""
+        conn = self._clients[client_sock]
         try:
             while True:
-                data = client_sock.recv(4096)
-                if not data:
+                if not conn.reader.recv_from(client_sock):
                     break
-                buf += data
-                while b"\n" in buf:
-                    line, buf = buf.split(b"\n", 1)
-                    line = line.decode("utf-8").strip()
-                    if not line:
+                for parts, body in conn.reader.frames():
+                    self._handle_command(conn, parts, body)
+        except (OSError, ValueError):
+            # conexão quebrada ou frame inválido
+            pass
+        finally:
+            self._drop_client(client_sock)
+
+    def _handle_command(self, conn: _Connection, parts: list[Any], body: bytes) -> None:
+        cmd = parts[0].upper()
+
+        if cmd == "SUB" and len(parts) >= 2 and conn.peer:
+            # interesse de outro broker: só o ao vivo, sem replay nem retido
+            try:
+                self._subs.add(parts[1], conn.sock)
+            except ValueError:
+                pass
+
+        elif cmd == "SUB" and len(parts) >= 2:
+            topic = parts[1]
+            options = self._parse_options(parts[2:])
+            # inproc não perde mensagem no caminho: qos=1 não se aplica
+            if options.get("qos") == "1" and conn.window is None and not conn.inproc:
+                try:
+                    size = max(1, int(options.get("window", self._ack_window)))
+                except ValueError:
+                    return
+                conn.window = InflightWindow(
+                    size,
+                    self._ack_timeout,
+                    Outbox(self._outbox_size, self._overflow),
+                    # a janela já limita o volume; o outbox não pode bloquear aqui
+                    lambda frame, tag: self._enqueue(conn, frame, force=True, tag=tag),
+                )
+            filter = None
+            if "filter" in options:
+                try:
+                    filter = compile_filter(options["filter"])
+                except ValueError:
+                    # filtro inválido: o SUB é ignorado, como um padrão inválido
+                    self._metrics.counters.add(("broker.rejected_subs", ""))
+                    return
+            # conflate=topic, ou conflate=<campo> (ex.: id, headers.vehicle)
+            conflate = options.get("conflate")
+            if "group" in options:
+                # grupos dividem as mensagens ao vivo; replay/retido não se aplicam.
+                # Filtro e conflação não valem para grupos: o SUB é recusado
+                if filter is not None or conflate is not None:
+                    self._metrics.counters.add(("broker.rejected_subs", ""))
+                    return
+                strategy = options.get("balance", self._group_strategy)
+                try:
+                    self._subs.add(topic, conn.sock, options["group"], strategy)
+                except ValueError:
+                    return
+                self._advertise()
+                return
+            if self._store is not None and ("from" in options or "since" in options):
+                t = threading.Thread(
+                    target=self._replay,
+                    args=(conn, topic, options, filter, conflate),
+                    daemon=True,
+                )
+                t.start()
+                return
+            try:
+                if self._retained is not None:
+                    self._subscribe_retained(conn, topic, filter, conflate)
+                else:
+                    self._subs.add(
+                        topic, conn.sock, filter=filter, conflate=conflate
+                    )
+            except ValueError:
+                # padrão de tópico inválido; ignorado como comando desconhecido
+                return
+            self._advertise()
+
+        elif cmd == "UNSUB" and len(parts) >= 2:
+            options = self._parse_options(parts[2:])
+            self._subs.remove(parts[1], conn.sock, options.get("group"))
+            if not conn.peer:
+                self._advertise()
+
+        elif cmd == "PUB" and len(parts) >= 2:
+            codec = parts[3] if len(parts) > 3 else DEFAULT_CODEC
+            self._throttle(conn, parts[1])
+            self._publish(parts[1], body, codec)
+            self._count_in(conn, 1, len(body))
+            if conn.flow:
+                self._grant(conn, 1)
+
+        elif cmd == "MPUB":
+            codec = parts[3] if len(parts) > 3 else DEFAULT_CODEC
+            n = 0
+            for topic, data in iter_batch(body, binary=conn.version >= 2):
+                self._throttle(conn, topic)
+                self._publish(topic, data, codec)
+                n += 1
+            self._count_in(conn, n, len(body))
+            if conn.flow:
+                self._grant(conn, n)
+
+        elif cmd == "CHUNK" and len(parts) >= 5 and not conn.inproc:
+            self._chunk(conn, parts[1], body, parts[3], parts[4])
+
+        elif cmd == "ACK" and len(parts) >= 2:
+            if conn.window is None:
+                return
+            for token in parts[1:]:
+                try:
+                    msg_id = int(token)
+                except ValueError:
+                    continue
+                if not conn.window.ack(msg_id):
+                    self._disconnect(conn)
+                    return
+            if conn.waiters:
+                self._resume_waiters(conn)
+
+        elif cmd == "HELLO" and len(parts) >= 2 and conn.version == 1:
+            # negociação: fica com a maior versão suportada pelos dois lados
+            try:
+                version = min(int(parts[1]), PROTOCOL_VERSION)
+                options = self._parse_options(parts[2:])
+                codec = options.get("codec")
+                conn.codec = get_codec(codec).name if codec else None
+            except ValueError:
+                return
+            reply = f"HELLO {version}"
+            if options.get("flow") == "1" and self._publish_credits > 0:
+                conn.flow = True
+                reply += f" credits={self._publish_credits}"
+            if self._max_message > 0:
+                # o cliente fragmenta o que passar disso
+                reply += f" max={self._max_message}"
+            self._enqueue(conn, f"{reply}\n".encode("utf-8"), force=True)
+            if version >= 2:
+                conn.version = version
+                conn.reader.binary = True
+
+        elif cmd == "PEER" and len(parts) >= 2:
+            # link de outro broker; as métricas passam a usar o nome do nó
+            self._metrics.counters.forget(conn.name, "conn.")
+            conn.name = f"peer:{parts[1]}"
+            conn.peer = True
+            self._peer_socks.add(conn.sock)
+
+        elif cmd == "STATS":
+            # resposta como MSG no tópico $SYS.stats, em JSON
+            body = encode_envelope(self.stats(), None, "json")
+            frame = encode_frame("MSG", "$SYS.stats", body, conn.version >= 2, "json")
+            self._enqueue(conn, frame, force=True)
+
+        else:
+            # comando desconhecido
+            pass
+
+    @staticmethod
+    def _parse_options(tokens: list[str]) -> Dict[str, str]:
+        options = {}
+        for i, token in enumerate(tokens):
+            key, sep, value = token.partition("=")
+            if not sep:
+                continue
+            if key.lower() == "filter":
+                # o FrameReader (split_options) e o inproc entregam filter= num
+                # só token, com os espaços da expressão preservados
+                options["filter"] = " ".join([value] + tokens[i + 1 :])
+                break
+            options[key.lower()] = value
+        return options
+
+    def _count_in(self, conn: _Connection, n: int, size: int) -> None:
+        self._metrics.counters.add_all(
+            ((("conn.msgs_in", conn.name), n), (("conn.bytes_in", conn.name), size))
+        )
+
+    def _chunk(
+        self, conn: _Connection, topic: str, body: bytes, codec: str, token: int
+    ) -> None:
+        # repassa o fragmento já no thread que o leu: no modo threads o outbox
+        # cheio de um inscrito segura a leitura do publicador (memória estável)
+        state = self._stream(conn.streams, topic, body, codec, token)
+        if state is None:
+            return
+        # a mensagem conta uma vez, no último fragmento; os bytes, a cada um
+        n = 1 if parse_chunk_token(token)[2] & CHUNK_LAST else 0
+        self._count_in(conn, n, len(body))
+        if threading.current_thread() is self._loop_thread:
+            # o loop não espera pelo outbox: o fragmento já entrou e o
+            # publicador para de ser lido até o inscrito esvaziar (inproc não
+            # passa pelo selector e não teria quem retomasse o publicador)
+            for target in state[3]:
+                if not target.inproc and self._full(target):
+                    self._pause(conn, target)
+                    break
+
+    def _relay_chunk(
+        self, streams: dict, topic: str, body: bytes, codec: str, token: int
+    ) -> None:
+        # fragmento que chegou por um link: segue só para os inscritos locais
+        self._stream(streams, topic, body, codec, token, relayed=True)
+
+    def _stream(
+        self,
+        streams: dict,
+        topic: str,
+        body: bytes,
+        codec: str,
+        token: int,
+        relayed: bool = False,
+    ) -> Optional[tuple]:
+        stream, seq, flags = parse_chunk_token(token)
+        state = streams.get(stream)
+        if state is None:
+            if seq != 0:
+                # stream sem início (ou já encerrado): descarta o resto
+                return None
+            targets = self._stream_targets(topic, relayed)
+            # inproc recebe a mensagem inteira: só ele guarda os fragmentos
+            pending = [] if any(t.inproc for t in targets) else None
+            state = (next(self._stream_ids), topic, codec, targets, pending)
+            streams[stream] = state
+        if flags & (CHUNK_LAST | CHUNK_ABORT):
+            del streams[stream]
+        n = 1 if flags & CHUNK_LAST else 0
+        self._metrics.counters.add_all(
+            ((("topic.msgs_in", topic), n), (("topic.bytes_in", topic), len(body)))
+        )
+        self._forward_chunk(state, chunk_token(state[0], seq, flags), body)
+        return state
+
+    def _stream_targets(self, topic: str, relayed: bool = False) -> list[_Connection]:
+        # inscritos do stream, fixados no primeiro fragmento: um grupo escolhe
+        # um membro para o stream inteiro; filtro e conflação não se aplicam a
+        # fragmentos (SUB com filtro fica de fora). Links de peers recebem os
+        # fragmentos, exceto os que vieram de outro broker
+        targets = []
+        for entry in self._subs.get(topic):
+            if isinstance(entry, Subscription):
+                if entry.filter is not None:
+                    continue
+                entry = entry.client
+            elif isinstance(entry, SubscriberGroup):
+                entry = entry.pick()
+            conn = self._clients.get(entry)  # type: ignore[arg-type]
+            if conn is not None and not (relayed and conn.peer):
+                targets.append(conn)
+        return targets
+
+    def _forward_chunk(
+        self,
+        state: tuple[int, str, str, list[_Connection], Optional[list[bytes]]],
+        token: int,
+        body: bytes,
+    ) -> None:
+        stream, topic, codec, targets, pending = state
+        # um frame por versão de protocolo; o codec segue o do publicador
+        frames: Dict[bool, bytes] = {}
+        for target in targets:
+            if target.closed or target.inproc:
+                continue
+            binary = target.version >= 2
+            frame = frames.get(binary)
+            if frame is None:
+                frame = frames[binary] = encode_frame(
+                    "CHUNK", topic, body, binary, codec, token
+                )
+            tag = ((("conn.bytes_out", target.name), len(frame)),)
+            if token & CHUNK_LAST:
+                tag += ((("conn.msgs_out", target.name), 1),)
+            # fragmento perdido corrompe a mensagem inteira: nenhuma política
+            # descarta fragmentos; outbox cheio segura o publicador (wait; no
+            # selector, _chunk pausa a leitura dele)
+            self._enqueue(target, frame, wait=True, keep=True, tag=tag)
+        if pending is None or token & CHUNK_ABORT:
+            return
+        pending.append(body)
+        if not token & CHUNK_LAST:
+            return
+        encoded = EncodedMessage(topic, b"".join(pending), codec)
+        pending.clear()
+        for target in targets:
+            if target.inproc and not target.closed:
+                tag = (
+                    (("topic.msgs_out", topic), 1),
+                    (("conn.msgs_out", target.name), 1),
+                )
+                self._enqueue(target, encoded, wait=True, keep=True, tag=tag)
+
+    def _abort_streams(self, conn: _Connection) -> None:
+        # publicador caiu no meio: os inscritos descartam o que já remontaram
+        streams, conn.streams = conn.streams, {}
+        for state in streams.values():
+            self._forward_chunk(state, chunk_token(state[0], 0, CHUNK_ABORT), b"")
+
+    def _throttle(self, conn: _Connection, topic: str) -> None:
+        # política "block": o consumer nunca espera por um inscrito lento (o
+        # fan-out dos outros tópicos segue) e quem segura é o publicador. Antes
+        # de publicar ele espera cada inscrito do tópico ter espaço; o loop do
+        # selector não pode esperar, então publica e para de ler o publicador
+        # até o inscrito esvaziar
+        if self._overflow != "block":
+            return
+        while True:
+            target = self._full_subscriber(topic)
+            if target is None:
+                return
+            if threading.current_thread() is self._loop_thread:
+                self._pause(conn, target)
+                return
+            target.outbox.wait_space()
+            if target.window is not None:
+                target.window.wait_space()
+
+    def _full_subscriber(self, topic: str) -> Optional[_Connection]:
+        # inscrito do tópico sem espaço (num grupo, só se todos os membros estão)
+        for entry in self._subs.get(topic):
+            if isinstance(entry, SubscriberGroup):
+                members = [self._clients.get(m) for m in entry.members]
+                full = [c for c in members if c is not None and self._full(c)]
+                if full and len(full) == len(members):
+                    return full[0]
+                continue
+            if isinstance(entry, Subscription):
+                entry = entry.client
+            target = self._clients.get(entry)  # type: ignore[arg-type]
+            if target is not None and self._full(target):
+                return target
+        return None
+
+    @staticmethod
+    def _full(conn: _Connection) -> bool:
+        if conn.closed:
+            return False
+        return conn.outbox.full() or (conn.window is not None and conn.window.full())
+
+    def _relay(self, topic: str, body: bytes, codec: str) -> None:
+        # mensagem que chegou por um link: entrega local, sem repassar de novo
+        self._publish(topic, body, codec, relayed=True)
+
+    def _advertise(self) -> None:
+        # chamado a cada SUB/UNSUB/queda, até no loop do selector: só marca.
+        # O recálculo (_announce) roda uma vez por volta do _maintain
+        if self._links:
+            self._interest_changed.set()
+
+    def _announce(self) -> None:
+        # recalcula o interesse local inteiro; cada link manda a diferença no
+        # próprio thread, sem segurar quem chamou
+        self._interest_changed.clear()
+        patterns = summarize(
+            self._subs.patterns(self._peer_socks), self._peer_interest_limit
+        )
+        for link in self._links:
+            link.advertise(patterns)
+
+    # --- clientes inproc (transports.InprocClient): mesmo processo, sem socket ---
+
+    def connect_inproc(self, name: str) -> _Connection:
+        sock = InprocSocket()
+        conn = self._new_connection(sock, f"inproc://{name}#{next(self._inproc_ids)}")
+        conn.inproc = True
+        sock.on_close = functools.partial(self._drop_client, sock)
+        return conn
+
+    def inproc_command(self, conn: _Connection, parts: list[str]) -> None:
+        # SUB/UNSUB com as mesmas opções do protocolo, já separadas
+        self._handle_command(conn, parts, b"")
+
+    def inproc_publish(
+        self,
+        conn: _Connection,
+        topic: str,
+        payload: Any,
+        headers: Optional[Dict[str, str]] = None,
+        codec: str = DEFAULT_CODEC,
+    ) -> None:
+        # o objeto do publicador segue até os inscritos; só é codificado se
+        # algum inscrito por socket (ou o log) precisar de bytes
+        self._throttle(conn, topic)
+        self._metrics.counters.add_all(
+            ((("topic.msgs_in", topic), 1), (("conn.msgs_in", conn.name), 1))
+        )
+        received = time.monotonic()
+        trace = None
+        if self._tracer is not None:
+            trace = self._tracer.sample(topic, received)
+        self._route(
+            Message(
+                topic,
+                payload,
+                headers or {},
+                codec=codec,
+                received=received,
+                trace=trace,
+            )
+        )
+
+    def _publish(
+        self,
+        topic: str,
+        body: bytes,
+        codec: str = DEFAULT_CODEC,
+        relayed: bool = False,
+    ) -> None:
+        received = time.monotonic()
+        self._metrics.counters.add_all(
+            ((("topic.msgs_in", topic), 1), (("topic.bytes_in", topic), len(body)))
+        )
+        trace = None
+        if self._tracer is not None:
+            trace = self._tracer.sample(topic, received)
+        if self._passthrough:
+            msg = Message(
+                topic=topic,
+                payload=None,
+                body=body,
+                codec=codec,
+                received=received,
+                relayed=relayed,
+                trace=trace,
+            )
+        else:
+            obj = Marshaller.decode(body, codec)
+            msg = Message(
+                topic=topic,
+                payload=obj.get("payload"),
+                headers=obj.get("headers", {}),
+                codec=codec,
+                received=received,
+                relayed=relayed,
+                trace=trace,
+            )
+        if trace is not None:
+            trace.mark("parse", bytes=len(body))
+        self._route(msg)
+
+    def _route(self, msg: Message) -> None:
+        if self._store is None:
+            self._engine.publish(msg)
+            return
+
+        if msg.body is None:
+            # codifica uma vez: o mesmo corpo vai para o log e para o frame MSG
+            msg = Message(
+                msg.topic,
+                msg.payload,
+                msg.headers,
+                Marshaller.encode(msg),
+                msg.codec,
+                msg.received,
+                msg.relayed,
+                msg.trace,
+            )
+        log = self._store.log(msg.topic)
+        with log.lock:
+            log.append(msg.body, flags=get_codec(msg.codec).id)
+            if msg.trace is not None:
+                msg.trace.mark("store")
+            self._engine.publish(msg)
+
+    def _load(self, client_sock: object) -> int:
+        # carga de um membro de grupo: frames no outbox mais os sem ACK
+        conn = self._clients.get(client_sock)  # type: ignore[arg-type]
+        if conn is None:
+            return 1 << 30
+        load = len(conn.outbox)
+        if conn.window is not None:
+            load += conn.window.backlog()
+        return load
+
+    def _grant(self, conn: _Connection, n: int) -> None:
+        # devolve os créditos em lotes; com o engine cheio o publicador fica sem
+        # crédito (e bloqueado) até o thread de manutenção ver a fila esvaziar
+        with conn.lock:
+            conn.owed += n
+            if conn.owed < max(1, self._publish_credits // 4):
+                return
+            if sum(self._engine.depths()) >= self._max_queued:
+                with self._starved_lock:
+                    self._starved.add(conn)
+                return
+            owed, conn.owed = conn.owed, 0
+        frame = encode_frame("CREDIT", str(owed), binary=conn.version >= 2)
+        self._enqueue(conn, frame, force=True)
+
+    def _maintain(self) -> None:
+        interval = min(0.1, self._ack_timeout / 4)
+        next_dump = time.monotonic() + self._stats_interval
+        while True:
+            time.sleep(interval)
+            now = time.monotonic()
+            if self._stats_interval > 0 and now >= next_dump:
+                next_dump = now + self._stats_interval
+                self._dump_stats()
+            if self._tracer is not None:
+                self._tracer.flush()
+            for conn in list(self._clients.values()):
+                if conn.window is not None and not conn.window.redeliver(now):
+                    self._disconnect(conn)
+            if self._starved and sum(self._engine.depths()) < self._max_queued:
+                with self._starved_lock:
+                    starved, self._starved = self._starved, set()
+                for conn in starved:
+                    self._grant(conn, 0)
+            if self._interest_changed.is_set():
+                self._announce()
+
+    def stats(self) -> Dict[str, Any]:
+        snap = self._metrics.snapshot()
+        # "topic.msgs_in" -> topics[tópico]["msgs_in"], idem para conexões
+        scopes: Dict[str, Dict[str, Dict[str, int]]] = {
+            "topic": {},
+            "conn": {},
+            "broker": {},
+        }
+        for name, labels in snap["counters"].items():
+            scope, _, metric = name.partition(".")
+            for label, n in labels.items():
+                scopes[scope].setdefault(label, {})[metric] = n
+        connections = {}
+        for conn in list(self._clients.values()):
+            stats = dict(scopes["conn"].get(conn.name, {}))
+            stats["outbox"] = len(conn.outbox)
+            stats["dropped"] = conn.outbox.dropped
+            stats["conflated"] = conn.outbox.conflated
+            if conn.window is not None:
+                stats["in_flight"] = conn.window.in_flight()
+                stats["redelivered"] = conn.window.redelivered
+            connections[conn.name] = stats
+        return {
+            "time": time.time(),
+            "uptime": time.time() - self._started,
+            "mode": self._mode,
+            "node": self._node,
+            "queues": self._engine.depths(),
+            "threads": {
+                "total": threading.active_count(),
+                "consumers": sum(c.is_alive() for c in self._consumers),
+                "consumer_errors": sum(c.errors for c in self._consumers),
+            },
+            "totals": scopes["broker"].get("", {}),
+            "topics": scopes["topic"],
+            "connections": connections,
+            "peers": {
+                link.address: {
+                    "connected": link.connected,
+                    "interest": link.interest,
+                    "relayed": link.relayed,
+                }
+                for link in self._links
+            },
+            "latency": snap["latency"],
+        }
+
+    def _dump_stats(self) -> None:
+        line = json.dumps(self.stats())
+        if self._stats_file is None:
+            print(line)
+            return
+        with open(self._stats_file, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def _replay(
+        self,
+        conn: _Connection,
+        pattern: str,
+        options: Dict[str, str],
+        filter: Optional[Filter] = None,
+        conflate: Optional[str] = None,
+    ) -> None:
+        assert self._store is not None
+        try:
+            start = int(options.get("from", 0))
+            since = float(options["since"]) if "since" in options else None
+        except ValueError:
+            return
+
+        self._hold(conn)
+        try:
+            self._subs.add(pattern, conn.sock, filter=filter, conflate=conflate)
+            self._advertise()
+            # o fim de cada log é fixado depois da inscrição; mensagens publicadas
+            # nessa fronteira podem chegar duas vezes (replay e ao vivo)
+            for topic in self._store.topics():
+                if not matches(pattern, topic):
+                    continue
+                log = self._store.log(topic)
+                end = log.next_offset
+                first = log.offset_for_time(since) if since is not None else start
+                for _, _, body, flags in log.read(first, end):
+                    codec = CODECS_BY_ID[flags].name
+                    if filter is not None and not self._passes(filter, body, codec):
+                        continue
+                    item = self._item(conn, EncodedMessage(topic, body, codec))
+                    if item is None:
                         continue
-                    parts = line.split()
-                    cmd = parts[0].upper()
-
-                    if cmd == "SUB" and len(parts) == 2:
-                        topic = parts[1]
-                        self._subs.add(topic, client_sock)
-
-                    elif cmd == "PUB" and len(parts) == 3:
-                        topic = parts[1]
-                        size = int(parts[2])
-                        while len(buf) < size:
-                            more = client_sock.recv(4096)
-                            if not more:
-                                return
-                            buf += more
-                        payload_bytes, buf = buf[:size], buf[size:]
-                        obj = Marshaller.decode(payload_bytes)
-                        msg = Message(
-                            topic=topic,
-                            payload=obj.get("payload"),
-                            headers=obj.get("headers", {}),
-                        )
-                        self._engine.publish(msg)
-
-                    else:
-                        # comando desconhecido
-                        pass
+                    if not self._enqueue(conn, item, wait=True):
+                        return
+        except ValueError:
+            # padrão de tópico inválido
+            pass
+        finally:
+            self._release(conn)
+
+    def _subscribe_retained(
+        self,
+        conn: _Connection,
+        pattern: str,
+        filter: Optional[Filter] = None,
+        conflate: Optional[str] = None,
+    ) -> None:
+        assert self._retained is not None
+        # segura o ao vivo para o valor retido nunca chegar depois de um mais novo
+        self._hold(conn)
+        try:
+            self._subs.add(pattern, conn.sock, filter=filter, conflate=conflate)
+            for encoded in self._retained.match(pattern):
+                if filter is not None and not self._passes(
+                    filter, encoded.body, encoded.codec
+                ):
+                    continue
+                item = self._item(conn, encoded)
+                if item is not None:
+                    self._enqueue(conn, item)
         finally:
-            for topic in list(self._subs._subs.keys()):
-                self._subs.remove(topic, client_sock)
-            client_sock.close()
+            self._release(conn)
+
+    def _item(self, conn: _Connection, encoded: EncodedMessage) -> Any:
+        # o que vai para o outbox: frame do socket ou a própria mensagem (inproc)
+        return encoded if conn.inproc else self._frame(conn, encoded)
+
+    def _frame(
+        self, conn: _Connection, encoded: EncodedMessage, with_id: bool = False
+    ) -> Optional[bytes]:
+        # None: o corpo não converte para o codec do inscrito (ex.: corpo
+        # inválido em pass-through); só esse inscrito fica sem a mensagem
+        try:
+            return encoded.frame(conn.version, conn.codec, with_id)
+        except ValueError:
+            self._metrics.counters.add(("broker.transcode_errors", ""))
+            return None
+
+    @staticmethod
+    def _passes(filter: Filter, body: bytes, codec: str) -> bool:
+        try:
+            doc = Marshaller.decode(body, codec)
+        except ValueError:
+            return False
+        return filter.matches(doc)
+
+    def _hold(self, conn: _Connection) -> None:
+        with conn.lock:
+            conn.holds += 1
+            if conn.held is None:
+                conn.held = []
+
+    def _release(self, conn: _Connection) -> None:
+        with conn.lock:
+            conn.holds -= 1
+            if not conn.holds:
+                held, conn.held = conn.held or [], None
+                for frame, msg_id, key, origin, tag in held:
+                    self._deliver(conn, frame, msg_id, key, origin, tag=tag)
+
+    def _drop_client(self, client_sock: socket.socket) -> None:
+        self._subs.remove_client(client_sock)
+        if client_sock in self._peer_socks:
+            self._peer_socks.discard(client_sock)
+        else:
+            self._advertise()
+        conn = self._clients.pop(client_sock, None)
+        if conn is not None:
+            if conn.streams:
+                self._abort_streams(conn)
+            self._metrics.counters.forget(conn.name, "conn.")
+            conn.outbox.close()
+            if conn.window is not None:
+                conn.window.close()
+            with self._starved_lock:
+                self._starved.discard(conn)
+        client_sock.close()
+
+    # --- modo selector: um único loop atende todas as conexões ---
+
+    def _serve_selector(self, listeners: list[socket.socket]) -> None:
+        sel = selectors.DefaultSelector()
+        self._selector = sel
+        self._loop_thread = threading.current_thread()
+        for listener in listeners:
+            listener.setblocking(False)
+            sel.register(listener, selectors.EVENT_READ, None)
+        sel.register(self._wake_r, selectors.EVENT_READ, self._wake_r)
+
+        while True:
+            for key, events in sel.select():
+                if key.data is None:
+                    self._accept_nonblocking(key.fileobj)  # type: ignore[arg-type]
+                elif key.data is self._wake_r:
+                    self._on_wake()
+                else:
+                    conn: _Connection = key.data
+                    if events & selectors.EVENT_READ:
+                        self._on_readable(conn)
+                    if events & selectors.EVENT_WRITE and not conn.closed:
+                        self._on_writable(conn)
+
+    def _accept_nonblocking(self, listener: socket.socket) -> None:
+        assert self._selector is not None
+        while True:
+            try:
+                client_sock, addr = listener.accept()
+            except BlockingIOError:
+                return
+            client_sock.setblocking(False)
+            conn = self._new_connection(client_sock, addr)
+            self._selector.register(client_sock, selectors.EVENT_READ, conn)
+
+    def _on_wake(self) -> None:
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        for conn in dirty:
+            if not conn.closed:
+                self._on_writable(conn)
+
+    def _on_readable(self, conn: _Connection) -> None:
+        if conn.paused:
+            # pausado por outro evento da mesma volta do select
+            return
+        try:
+            n = conn.reader.recv_from(conn.sock)
+        except BlockingIOError:
+            return
+        except OSError:
+            n = 0
+        if not n:
+            self._close_connection(conn)
+            return
+        self._process_frames(conn)
+
+    def _process_frames(self, conn: _Connection) -> None:
+        try:
+            for parts, body in conn.reader.frames():
+                self._handle_command(conn, parts, body)
+                if conn.paused or conn.closed:
+                    # o resto fica no reader até o publicador ser retomado
+                    break
+        except Exception:
+            # frame inválido ou erro ao tratar o comando: só esta conexão cai,
+            # o loop segue atendendo as outras
+            self._metrics.counters.add(("broker.command_errors", ""))
+            self._close_connection(conn)
+
+    def _on_writable(self, conn: _Connection) -> None:
+        assert self._selector is not None
+        while len(conn.outbuf) < 65536:
+            frames = conn.outbox.drain(64)
+            if not frames:
+                break
+            for frame in frames:
+                conn.outbuf += frame
+        try:
+            if conn.outbuf and self._tracer is not None and self._tracer.sampled():
+                start = time.monotonic()
+                sent = conn.sock.send(conn.outbuf)
+                self._tracer.span(
+                    "sendall", start, time.monotonic(), args={"bytes": sent}
+                )
+            else:
+                sent = conn.sock.send(conn.outbuf) if conn.outbuf else 0
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._metrics.counters.add(("broker.send_errors", ""))
+            self._close_connection(conn)
+            return
+        if sent > 0:
+            del conn.outbuf[:sent]
+        self._update_events(conn)
+        if conn.waiters:
+            self._resume_waiters(conn)
+
+    def _update_events(self, conn: _Connection) -> None:
+        # publicador pausado sai da leitura; sem eventos, sai do selector
+        assert self._selector is not None
+        events = 0 if conn.paused else selectors.EVENT_READ
+        if conn.outbuf or len(conn.outbox):
+            events |= selectors.EVENT_WRITE
+        registered = conn.sock in self._selector.get_map()
+        if not events:
+            if registered:
+                self._selector.unregister(conn.sock)
+        elif registered:
+            self._selector.modify(conn.sock, events, conn)
+        else:
+            self._selector.register(conn.sock, events, conn)
+
+    def _pause(self, conn: _Connection, target: _Connection) -> None:
+        if conn.paused or conn.closed:
+            return
+        conn.paused = True
+        target.waiters.add(conn)
+        self._update_events(conn)
+
+    def _resume_waiters(self, target: _Connection) -> None:
+        if not target.closed and self._full(target):
+            return
+        waiters, target.waiters = target.waiters, set()
+        for conn in waiters:
+            if conn.closed:
+                continue
+            conn.paused = False
+            self._update_events(conn)
+            # frames já lidos antes da pausa
+            self._process_frames(conn)
+
+    def _close_connection(self, conn: _Connection) -> None:
+        if conn.closed:
+            return
+        conn.closed = True
+        assert self._selector is not None
+        try:
+            self._selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        self._drop_client(conn.sock)
+        if conn.waiters:
+            self._resume_waiters(conn)
 
-    def _send_to_client(self, client_sock: socket.socket, msg: Message) -> None:
+    def queue_depths(self) -> list[int]:
+        return self._engine.depths()
+
+    def _encode_frame(self, msg: Message) -> EncodedMessage:
+        # o id só vai no frame de quem assina com qos=1
+        msg_id = next(self._msg_ids)
+        # o corpo só é codificado quando um inscrito por socket pede o frame
+        encode = functools.partial(
+            Marshaller.encode if msg.trace is None else self._traced_encode, msg
+        )
+        return EncodedMessage(
+            msg.topic,
+            msg.body,
+            msg.codec,
+            msg_id,
+            msg.received,
+            msg.relayed,
+            encode,
+            msg,
+        )
+
+    @staticmethod
+    def _traced_encode(msg: Message) -> bytes:
+        start = time.monotonic()
+        body = Marshaller.encode(msg)
+        msg.trace.span("encode", start, time.monotonic(), bytes=len(body))
+        return body
+
+    def _send_to_client(
+        self, client_sock: socket.socket, encoded: EncodedMessage, key: Any = None
+    ) -> None:
+        conn = self._clients.get(client_sock)
+        if conn is None or conn.closed or (conn.peer and encoded.relayed):
+            return
+        # os contadores de saída vão como tag e só contam quando o frame sai do
+        # outbox (_observe_send): descartado pela política não conta como enviado
+        if conn.inproc:
+            frame: Any = encoded
+            msg_id = None
+            tag: tuple = (
+                (("topic.msgs_out", encoded.topic), 1),
+                (("conn.msgs_out", conn.name), 1),
+            )
+        else:
+            acked = conn.window is not None
+            frame = self._frame(conn, encoded, with_id=acked)
+            if frame is None:
+                return
+            msg_id = encoded.id if acked else None
+            tag = (
+                (("topic.msgs_out", encoded.topic), 1),
+                (("topic.bytes_out", encoded.topic), len(frame)),
+                (("conn.msgs_out", conn.name), 1),
+                (("conn.bytes_out", conn.name), len(frame)),
+            )
+        if conn.held is not None:
+            with conn.lock:
+                if conn.held is not None:
+                    conn.held.append((frame, msg_id, key, encoded.received, tag))
+                    return
+        trace = None
+        if self._tracer is not None and encoded.message is not None:
+            trace = encoded.message.trace
+        # com "block" o consumer não espera: o limite é aplicado ao publicador
+        # (_throttle) e o outbox pode passar dele pelo que já estava no engine
+        force = self._overflow == "block"
+        self._deliver(conn, frame, msg_id, key, encoded.received, trace, force, tag)
+
+    def _deliver(
+        self,
+        conn: _Connection,
+        frame: bytes,
+        msg_id: Optional[int],
+        key: Any = None,
+        origin: float = 0.0,
+        trace: Any = None,
+        force: bool = False,
+        tag: Any = None,
+    ) -> bool:
+        # key != None: SUB com conflate; o pendente com a mesma chave é trocado
+        if msg_id is None or conn.window is None:
+            return self._enqueue(
+                conn, frame, force=force, key=key, origin=origin, trace=trace, tag=tag
+            )
+        force = force or threading.current_thread() is self._loop_thread
+        if not conn.window.offer(msg_id, frame, force=force, key=key, tag=tag):
+            self._disconnect(conn)
+            return False
+        return True
+
+    def _enqueue(
+        self,
+        conn: _Connection,
+        frame: bytes,
+        wait: bool = False,
+        force: bool = False,
+        key: Any = None,
+        origin: float = 0.0,
+        trace: Any = None,
+        keep: bool = False,
+        tag: Any = None,
+    ) -> bool:
+        # o loop do selector nunca pode bloquear no outbox que ele mesmo esvazia;
+        # links de peers sempre esperam (não descartam nem derrubam o link)
+        force = force or threading.current_thread() is self._loop_thread
+        wait = wait or conn.peer
+        if not conn.outbox.put(frame, wait, force, key, origin, trace, keep, tag):
+            # política "disconnect" (ou conexão já fechada): derruba o subscriber
+            if not conn.closed:
+                self._metrics.counters.add(("broker.disconnects", ""))
+            self._disconnect(conn)
+            return False
+
+        if self._mode == "selector" and not conn.inproc:
+            with self._dirty_lock:
+                self._dirty.add(conn)
+            try:
+                self._wake_w.send(b"\0")
+            except OSError:
+                # o loop já tem um aviso pendente
+                pass
+        return True
+
+    @staticmethod
+    def _disconnect(conn: _Connection) -> None:
+        # o leitor (ou o loop do selector) vê o EOF e faz a limpeza
         try:
-            data = Marshaller.encode(msg)
-            header = f"MSG {msg.topic} {len(data)}\n".encode("utf-8")
-            client_sock.sendall(header + data)
+            conn.sock.shutdown(socket.SHUT_RDWR)
         except OSError:
-            # conexão quebrada; vamos só ignorar por enquanto
             pass
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    # vários nós no mesmo host, por exemplo:
+    #   python broker.py --port 6001 --peer 127.0.0.1:6002
+    #   python broker.py --port 6002 --peer 127.0.0.1:6001
+    p = argparse.ArgumentParser(description="broker MOM")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=5000)
+    p.add_argument("--mode", choices=Broker.MODES, default="threads")
+    p.add_argument("--consumers", type=int, default=1)
+    p.add_argument("--log-dir", default=None)
+    p.add_argument("--retain-topics", type=int, default=0)
+    p.add_argument("--peer", action="append", default=[], help="host:porta")
+    p.add_argument("--node", default=None)
+    p.add_argument("--trace-rate", type=float, default=0.0)
+    p.add_argument("--trace-file", default="mom-trace.json")
+    p.add_argument("--max-message", type=int, default=0)
+    args = p.parse_args(argv)
+    broker = Broker(
+        host=args.host,
+        port=args.port,
+        mode=args.mode,
+        consumers=args.consumers,
+        log_dir=args.log_dir,
+        retain_topics=args.retain_topics,
+        peers=args.peer,
+        node=args.node,
+        trace_rate=args.trace_rate,
+        trace_file=args.trace_file,
+        max_message=args.max_message,
+    )
+    broker.start()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,620 @@
+import itertools
 import socket
-import json
-from typing import Callable
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from queue import Queue
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from codec import (
+    BINARY_CODEC,
+    DEFAULT_CODEC,
+    decode_envelope,
+    encode_envelope,
+    get_codec,
+)
+from framing import (
+    CHUNK_ABORT,
+    CHUNK_LAST,
+    EncodedMessage,
+    Frame,
+    FrameReader,
+    batch_item_size,
+    chunk_token,
+    encode_batch,
+    encode_frame,
+    parse_chunk_token,
+)
+from transports import connect, lookup_inproc, parse_url
+
+
+def subscription_options(
+    offset: Optional[int] = None,
+    since: Optional[float] = None,
+    qos: int = 0,
+    window: Optional[int] = None,
+    group: Optional[str] = None,
+    balance: Optional[str] = None,
+    filter: Optional[str] = None,
+    conflate: Optional[str] = None,
+) -> list[str]:
+    # offset/since pedem replay do log durável antes das mensagens ao vivo;
+    # qos=1 liga a entrega com ACK (vale para a conexão inteira);
+    # inscritos do mesmo group dividem as mensagens entre si;
+    # filter é avaliado no broker, ex.: 'battery < 0.2 and prio >= 5';
+    # conflate ("topic" ou um campo, ex.: "id") deixa só a mais nova na fila;
+    # filter e conflate não se combinam com group (o broker recusa o SUB)
+    if group is not None and (filter is not None or conflate is not None):
+        raise ValueError("filter e conflate não se aplicam a grupos")
+    options = []
+    if offset is not None:
+        options.append(f"from={offset}")
+    if since is not None:
+        options.append(f"since={since}")
+    if qos:
+        options.append(f"qos={qos}")
+    if window is not None:
+        options.append(f"window={window}")
+    if group is not None:
+        options.append(f"group={group}")
+    if balance is not None:
+        options.append(f"balance={balance}")
+    if conflate is not None:
+        options.append(f"conflate={conflate}")
+    if filter is not None:
+        # vai por último: o broker lê filter= até o fim da linha
+        options.append(f"filter={filter}")
+    return options
+
+
+# (tópico, codec, corpo, id para ACK)
+_Job = tuple[str, str, bytes, Optional[int]]
+# on_chunk(tópico, stream, dados, último); dados None: o publicador caiu no meio
+OnChunk = Callable[[str, int, Optional[bytes], bool], None]
+
+
+def _deliver(
+    on_message: Callable[[str, Any], None], topic: str, codec: str, body: bytes
+) -> bool:
+    # roda no thread da fila ou num processo do pool (on_message precisa ser
+    # picklable, ex.: função de módulo). False: o corpo não decodifica (o
+    # broker em pass-through não valida); a mensagem é descartada, sem ACK
+    try:
+        obj = decode_envelope(body, codec)
+    except ValueError as exc:
+        print(f"mensagem inválida em {topic} descartada: {exc}", file=sys.stderr)
+        return False
+    on_message(topic, obj.get("payload"))
+    return True
+
+
+class Dispatcher:
+    def __init__(
+        self,
+        on_message: Callable[[str, Any], None],
+        workers: int,
+        processes: bool = False,
+        queue_size: int = 1000,
+        on_done: Optional[Callable[[int], None]] = None,
+    ) -> None:
+        # callbacks fora do thread de leitura; cada tópico cai sempre na mesma
+        # fila, então a ordem dentro do tópico é mantida. O limite é do total
+        # enfileirado (workers * queue_size), não de cada fila: um tópico lento
+        # acumula até esse total sem segurar a leitura, e só então o submit
+        # bloqueia (para todos os tópicos) até um worker liberar espaço
+        self._on_message = on_message
+        self._on_done = on_done
+        self._pool = ProcessPoolExecutor(workers) if processes else None
+        self._queues: list["Queue[Optional[_Job]]"] = [
+            Queue() for _ in range(workers)
+        ]
+        self._slots = threading.BoundedSemaphore(workers * queue_size)
+        self._threads = [
+            threading.Thread(target=self._run, args=(q,), daemon=True)
+            for q in self._queues
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(
+        self, topic: str, codec: str, body: bytes, ack: Optional[int] = None
+    ) -> None:
+        self._slots.acquire()
+        self._queues[hash(topic) % len(self._queues)].put((topic, codec, body, ack))
+
+    def _run(self, q: "Queue[Optional[_Job]]") -> None:
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            self._slots.release()
+            topic, codec, body, ack = item
+            try:
+                if self._pool is not None:
+                    delivered = self._pool.submit(
+                        _deliver, self._on_message, topic, codec, body
+                    ).result()
+                else:
+                    delivered = _deliver(self._on_message, topic, codec, body)
+            except Exception:
+                # um callback com erro não derruba a fila; sem ACK, qos=1 reenvia
+                traceback.print_exc()
+                continue
+            if delivered and ack is not None and self._on_done is not None:
+                self._on_done(ack)
+
+    def close(self) -> None:
+        # espera as filas esvaziarem
+        for q in self._queues:
+            q.put(None)
+        for t in self._threads:
+            t.join()
+        if self._pool is not None:
+            self._pool.shutdown()
 
 
 class Client:
-    def __init__(self, host: str = "127.0.0.1", port: int = 5000) -> None:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 5000,
+        batch_size: int = 1,
+        linger: float = 0.0,
+        protocol: int = 1,
+        hello_timeout: float = 1.0,
+        codec: Optional[str] = None,
+        accept_codec: Optional[str] = None,
+        flow_control: bool = False,
+        url: Optional[str] = None,
+        chunk_size: int = 0,
+    ) -> None:
+        # url (tcp:// ou unix://) substitui host/porta; para inproc:// use
+        # open_client ou InprocClient. Corpos maiores que chunk_size saem em
+        # fragmentos (CHUNK) e lotes de publish não passam dele; o max=
+        # anunciado pelo broker no HELLO (enviado sempre, mesmo no protocolo 1)
+        # vale quando é menor ou quando chunk_size é 0
         self._host = host
         self._port = port
-        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._sock.connect((self._host, self._port))
+        if url is not None:
+            self._sock = connect(url)
+        else:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._sock.connect((self._host, self._port))
+        self._reader = FrameReader()
+        self._binary = False
+        self._closed = False
+        # publish, linger e os ACKs do listen escrevem no mesmo socket
+        self._send_lock = threading.Lock()
+        # créditos de publicação concedidos pelo broker (None: sem controle de fluxo)
+        self._credits: Optional[int] = None
+        self._credit_cond = threading.Condition()
+        self._chunk_size = chunk_size
+        self._stream_ids = itertools.count(1)
+        # fragmentos recebidos de cada stream ainda aberto e o próximo seq
+        # esperado (um buraco na sequência descarta o stream)
+        self._partial: Dict[int, list[bytes]] = {}
+        self._chunk_seq: Dict[int, int] = {}
+        # codec usado nos publishes (sem codec: msgpack no protocolo 2, JSON
+        # no 1); accept_codec pede ao broker para converter as mensagens
+        # recebidas para esse codec
+        if codec is not None:
+            get_codec(codec)
+        if accept_codec is not None:
+            get_codec(accept_codec)
+        self._negotiate(protocol, hello_timeout, accept_codec, flow_control)
+        self._codec = get_codec(
+            codec or (BINARY_CODEC if self._binary else DEFAULT_CODEC)
+        ).name
 
-    def publish(self, topic: str, payload: dict) -> None:
-        data = json.dumps({"payload": payload}).encode("utf-8")
-        header = f"PUB {topic} {len(data)}\n".encode("utf-8")
-        self._sock.sendall(header + data)
+        # com controle de fluxo um thread lê o socket o tempo todo (os CREDIT
+        # chegam mesmo sem listen) e entrega os MSG ao listen por esta fila
+        self._inbox: "Optional[Queue[Optional[Frame]]]" = None
+        if self._credits is not None:
+            self._inbox = Queue()
+            t = threading.Thread(target=self._read_loop, daemon=True)
+            t.start()
 
-    def subscribe(self, topic: str) -> None:
-        cmd = f"SUB {topic}\n".encode("utf-8")
-        self._sock.sendall(cmd)
+        # batching de publish: junta até batch_size mensagens ou espera até linger
+        self._batch_size = batch_size
+        self._linger = linger
+        self._batch: list[tuple[str, bytes]] = []
+        # bytes do corpo do MPUB, que não pode passar de chunk_size
+        self._batch_bytes = 0
+        self._batch_started = 0.0
+        self._batch_cond = threading.Condition()
+        if batch_size > 1 and linger > 0:
+            t = threading.Thread(target=self._linger_loop, daemon=True)
+            t.start()
 
-    def listen(self, on_message: Callable[[str, dict], None]) -> None:
-        buf = b""
-        while True:
-            data = self._sock.recv(4096)
-            if not data:
-                break
-            buf += data
-            while b"\n" in buf:
-                line, buf = buf.split(b"\n", 1)
-                line = line.decode("utf-8").strip()
-                if not line:
+    def _negotiate(
+        self,
+        protocol: int,
+        timeout: float,
+        accept_codec: Optional[str],
+        flow_control: bool,
+    ) -> None:
+        # broker antigo não responde ao HELLO: seguimos no protocolo de texto
+        line = f"HELLO {protocol}"
+        if accept_codec is not None:
+            line += f" codec={accept_codec}"
+        if flow_control:
+            line += " flow=1"
+        self._sock.sendall(f"{line}\n".encode("utf-8"))
+        self._sock.settimeout(timeout)
+        try:
+            while True:
+                if not self._reader.recv_from(self._sock):
+                    raise ConnectionError("broker fechou a conexão no HELLO")
+                frame = next(self._reader.frames(), None)
+                if frame is not None:
+                    break
+        except socket.timeout:
+            return
+        finally:
+            self._sock.settimeout(None)
+        parts = frame[0]
+        if parts[0].upper() != "HELLO" or len(parts) < 2:
+            return
+        if int(parts[1]) >= 2:
+            self._binary = True
+            self._reader.binary = True
+        for token in parts[2:]:
+            key, _, value = token.partition("=")
+            if key == "credits":
+                self._credits = int(value)
+            elif key == "max":
+                limit = int(value)
+                if not self._chunk_size or limit < self._chunk_size:
+                    self._chunk_size = limit
+
+    @property
+    def protocol(self) -> int:
+        return 2 if self._binary else 1
+
+    def _send(self, data: bytes) -> None:
+        with self._send_lock:
+            self._sock.sendall(data)
+
+    def _acquire_credit(self) -> None:
+        # sem crédito o publish bloqueia até o broker mandar CREDIT
+        if self._credits is None:
+            return
+        with self._credit_cond:
+            while self._credits <= 0:
+                if self._closed:
+                    raise ConnectionError("conexão com o broker encerrada")
+                self._credit_cond.wait()
+            self._credits -= 1
+
+    def _add_credits(self, n: int) -> None:
+        with self._credit_cond:
+            self._credits = (self._credits or 0) + n
+            self._credit_cond.notify_all()
+
+    def publish(self, topic: str, payload: Any, codec: Optional[str] = None) -> None:
+        codec = get_codec(codec).name if codec else self._codec
+        data = encode_envelope(payload, None, codec)
+        if self._chunk_size and len(data) > self._chunk_size:
+            self.publish_stream(topic, (data,), codec)
+            return
+        self._acquire_credit()
+        if self._batch_size <= 1 or codec != self._codec:
+            # lotes usam só o codec padrão do cliente; o resto sai na hora, em ordem
+            if self._batch_size > 1:
+                self.flush()
+            self._send(encode_frame("PUB", topic, data, self._binary, codec))
+            return
+
+        with self._batch_cond:
+            size = batch_item_size(topic, len(data), self._binary)
+            if (
+                self._batch
+                and self._chunk_size
+                and self._batch_bytes + size > self._chunk_size
+            ):
+                self._flush_locked()
+            if not self._batch:
+                self._batch_started = time.monotonic()
+                self._batch_cond.notify()
+            self._batch.append((topic, data))
+            self._batch_bytes += size
+            if len(self._batch) >= self._batch_size:
+                self._flush_locked()
+
+    def publish_stream(
+        self, topic: str, chunks: Iterable[bytes], codec: Optional[str] = None
+    ) -> None:
+        # corpo já codificado, em pedaços (ex.: arquivo lido aos blocos com
+        # codec="raw"): cada pedaço sai como CHUNK assim que é lido e o broker
+        # o repassa na hora; nem aqui nem lá o corpo inteiro fica na memória.
+        # Streams não consomem créditos nem passam por log, retido ou filtros
+        codec = get_codec(codec).name if codec else self._codec
+        stream = next(self._stream_ids)
+        if self._batch_size > 1:
+            # o que está no lote foi publicado antes
+            self.flush()
+        seq = 0
+        pending: Optional[bytes] = None
+        for chunk in self._split(chunks):
+            if pending is not None:
+                token = chunk_token(stream, seq)
+                self._send(
+                    encode_frame("CHUNK", topic, pending, self._binary, codec, token)
+                )
+                seq += 1
+            pending = chunk
+        token = chunk_token(stream, seq, CHUNK_LAST)
+        self._send(
+            encode_frame("CHUNK", topic, pending or b"", self._binary, codec, token)
+        )
+
+    def _split(self, chunks: Iterable[bytes]) -> Iterable[bytes]:
+        size = self._chunk_size
+        for chunk in chunks:
+            if not size or len(chunk) <= size:
+                yield chunk
+                continue
+            view = memoryview(chunk)
+            for i in range(0, len(view), size):
+                yield view[i : i + size]
+
+    def flush(self) -> None:
+        with self._batch_cond:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        self._batch_bytes = 0
+        if len(batch) == 1:
+            topic, data = batch[0]
+            frame = encode_frame("PUB", topic, data, self._binary, self._codec)
+        else:
+            frame = encode_batch(batch, self._binary, self._codec)
+        self._send(frame)
+
+    def _linger_loop(self) -> None:
+        with self._batch_cond:
+            while not self._closed:
+                if not self._batch:
+                    self._batch_cond.wait()
+                    continue
+                remaining = self._batch_started + self._linger - time.monotonic()
+                if remaining > 0:
+                    self._batch_cond.wait(remaining)
                     continue
-                parts = line.split()
-                cmd = parts[0].upper()
-                if cmd == "MSG" and len(parts) == 3:
-                    topic = parts[1]
-                    size = int(parts[2])
-                    while len(buf) < size:
-                        more = self._sock.recv(4096)
-                        if not more:
-                            return
-                        buf += more
-                    payload_bytes, buf = buf[:size], buf[size:]
-                    obj = json.loads(payload_bytes.decode("utf-8"))
-                    on_message(topic, obj.get("payload"))
+                try:
+                    self._flush_locked()
+                except OSError:
+                    return
+
+    def subscribe(
+        self,
+        topic: str,
+        offset: Optional[int] = None,
+        since: Optional[float] = None,
+        qos: int = 0,
+        window: Optional[int] = None,
+        group: Optional[str] = None,
+        balance: Optional[str] = None,
+        filter: Optional[str] = None,
+        conflate: Optional[str] = None,
+    ) -> None:
+        options = subscription_options(
+            offset, since, qos, window, group, balance, filter, conflate
+        )
+        body = " ".join(options).encode("utf-8")
+        self._send(encode_frame("SUB", topic, body, self._binary))
+
+    def unsubscribe(self, topic: str, group: Optional[str] = None) -> None:
+        body = f"group={group}".encode("utf-8") if group is not None else b""
+        self._send(encode_frame("UNSUB", topic, body, self._binary))
+
+    def request_stats(self) -> None:
+        # a resposta chega no listen como mensagem do tópico $SYS.stats
+        self._send(encode_frame("STATS", "", binary=self._binary))
+
+    def listen(
+        self,
+        on_message: Callable[[str, Any], None],
+        workers: int = 0,
+        processes: bool = False,
+        queue_size: int = 1000,
+        on_chunk: Optional[OnChunk] = None,
+    ) -> None:
+        # workers > 0: decodificação e callbacks num pool (threads ou, com
+        # processes=True, processos), mantendo a ordem por tópico; a leitura
+        # do socket segue enquanto os callbacks rodam, até workers * queue_size
+        # mensagens enfileiradas no total. Mensagens fragmentadas
+        # são remontadas e entregues a on_message; com on_chunk cada fragmento
+        # vai direto para ele (no thread de leitura), sem remontar
+        dispatcher = None
+        if workers > 0:
+            dispatcher = Dispatcher(
+                on_message, workers, processes, queue_size, self._ack
+            )
+        try:
+            if self._inbox is not None:
+                while True:
+                    frame = self._inbox.get()
+                    if frame is None:
+                        break
+                    self._dispatch(
+                        frame[0], frame[1], on_message, dispatcher, on_chunk
+                    )
+                return
+
+            reader = self._reader
+            while True:
+                for parts, body in reader.frames():
+                    self._dispatch(parts, body, on_message, dispatcher, on_chunk)
+                if not reader.recv_from(self._sock):
+                    break
+        finally:
+            if dispatcher is not None:
+                dispatcher.close()
+
+    def _dispatch(
+        self,
+        parts: list[Any],
+        body: bytes,
+        on_message: Callable[[str, Any], None],
+        dispatcher: Optional[Dispatcher] = None,
+        on_chunk: Optional[OnChunk] = None,
+    ) -> None:
+        cmd = parts[0].upper()
+        if cmd == "MSG" and len(parts) >= 2:
+            topic = parts[1]
+            codec = parts[3] if len(parts) > 3 else DEFAULT_CODEC
+            ack = parts[4] if len(parts) > 4 else None
+            if dispatcher is not None:
+                dispatcher.submit(topic, codec, body, ack)
+                return
+            if _deliver(on_message, topic, codec, body) and ack is not None:
+                # ACK só depois do callback: se cair antes, o broker reenvia
+                self._ack(ack)
+        elif cmd == "CHUNK" and len(parts) >= 5:
+            topic, codec = parts[1], parts[3]
+            stream, seq, flags = parse_chunk_token(parts[4])
+            if not flags & CHUNK_ABORT and seq != self._chunk_seq.get(stream, 0):
+                # fragmento perdido: a mensagem não tem como ser remontada
+                lost = self._chunk_seq.pop(stream, None) is not None
+                self._partial.pop(stream, None)
+                if on_chunk is not None and lost:
+                    on_chunk(topic, stream, None, True)
+                return
+            if flags & (CHUNK_LAST | CHUNK_ABORT):
+                self._chunk_seq.pop(stream, None)
+            else:
+                self._chunk_seq[stream] = seq + 1
+            if on_chunk is not None:
+                data = None if flags & CHUNK_ABORT else body
+                on_chunk(topic, stream, data, bool(flags & (CHUNK_LAST | CHUNK_ABORT)))
+                return
+            if flags & CHUNK_ABORT:
+                self._partial.pop(stream, None)
+                return
+            self._partial.setdefault(stream, []).append(body)
+            if not flags & CHUNK_LAST:
+                return
+            body = b"".join(self._partial.pop(stream))
+            if dispatcher is not None:
+                dispatcher.submit(topic, codec, body)
+                return
+            _deliver(on_message, topic, codec, body)
+        elif cmd == "CREDIT" and len(parts) >= 2:
+            self._add_credits(int(parts[1]))
+
+    def _ack(self, msg_id: int) -> None:
+        try:
+            self._send(encode_frame("ACK", str(msg_id), binary=self._binary))
+        except OSError:
+            # conexão já caiu: o broker reenvia o que ficou sem ACK
+            pass
+
+    def _read_loop(self) -> None:
+        assert self._inbox is not None
+        reader = self._reader
+        try:
+            while True:
+                for parts, body in reader.frames():
+                    if parts[0].upper() == "CREDIT" and len(parts) >= 2:
+                        self._add_credits(int(parts[1]))
+                    else:
+                        self._inbox.put((parts, body))
+                if not reader.recv_from(self._sock):
+                    break
+        except OSError:
+            pass
+        finally:
+            self._inbox.put(None)
+            with self._credit_cond:
+                self._closed = True
+                self._credit_cond.notify_all()
 
     def close(self) -> None:
+        with self._batch_cond:
+            try:
+                self._flush_locked()
+            except OSError:
+                pass
+            self._closed = True
+            self._batch_cond.notify_all()
+        with self._credit_cond:
+            self._credit_cond.notify_all()
         self._sock.close()
+
+
+class InprocClient:
+    def __init__(self, name: str, codec: str = DEFAULT_CODEC) -> None:
+        # mesmo uso do Client, com um broker deste processo que escuta em
+        # inproc://<name>: publish entrega o próprio objeto, sem serializar
+        self._broker = lookup_inproc(name)
+        self._conn = self._broker.connect_inproc(name)
+        self._codec = get_codec(codec).name
+
+    @property
+    def protocol(self) -> int:
+        return 0
+
+    def publish(self, topic: str, payload: Any, codec: Optional[str] = None) -> None:
+        codec = get_codec(codec).name if codec else self._codec
+        self._broker.inproc_publish(self._conn, topic, payload, None, codec)
+
+    def flush(self) -> None:
+        pass
+
+    def subscribe(
+        self,
+        topic: str,
+        offset: Optional[int] = None,
+        since: Optional[float] = None,
+        qos: int = 0,
+        window: Optional[int] = None,
+        group: Optional[str] = None,
+        balance: Optional[str] = None,
+        filter: Optional[str] = None,
+        conflate: Optional[str] = None,
+    ) -> None:
+        # qos/window não se aplicam: nada se perde entre broker e cliente
+        options = subscription_options(
+            offset, since, 0, None, group, balance, filter, conflate
+        )
+        self._broker.inproc_command(self._conn, ["SUB", topic] + options)
+
+    def unsubscribe(self, topic: str, group: Optional[str] = None) -> None:
+        options = [f"group={group}"] if group is not None else []
+        self._broker.inproc_command(self._conn, ["UNSUB", topic] + options)
+
+    def request_stats(self) -> dict:
+        return self._broker.stats()
+
+    def listen(self, on_message: Callable[[str, Any], None]) -> None:
+        outbox = self._conn.outbox
+        while True:
+            item = outbox.get()
+            if item is None:
+                break
+            on_message(item.topic, self._payload(item))
+
+    @staticmethod
+    def _payload(item: EncodedMessage) -> Any:
+        msg = item.message
+        # pass-through (só corpo) ou mensagem vinda do log: decodifica
+        if msg is not None and (msg.body is None or msg.payload is not None):
+            return msg.payload
+        return decode_envelope(item.body, item.codec).get("payload")
+
+    def close(self) -> None:
+        self._conn.sock.close()
+
+
+def open_client(url: str, **options: Any) -> Any:
+    # Client para tcp:// e unix://, InprocClient para inproc://
+    scheme, address = parse_url(url)
+    if scheme == "inproc":
+        return InprocClient(address, **options)
+    return Client(url=url, **options)
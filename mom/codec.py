@@ -0,0 +1,275 @@
+import json
+import struct
+from typing import Any, Dict, Optional
+
+
+class Codec:
+    name = ""
+    id = 0
+    # codecs sem envelope carregam só o payload (sem headers)
+    envelope = True
+
+    def encode(self, obj: Any) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, data: bytes) -> Any:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    name = "json"
+    id = 0
+
+    def encode(self, obj: Any) -> bytes:
+        return json.dumps(obj).encode("utf-8")
+
+    def decode(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class RawCodec(Codec):
+    name = "raw"
+    id = 2
+    envelope = False
+
+    def encode(self, obj: Any) -> bytes:
+        if not isinstance(obj, (bytes, bytearray, memoryview)):
+            raise TypeError("codec raw só aceita payload em bytes")
+        return bytes(obj)
+
+    def decode(self, data: bytes) -> Any:
+        return bytes(data)
+
+
+class MsgPackCodec(Codec):
+    # subconjunto do formato MessagePack: nil, bool, int, float64, str, bin,
+    # array e map; compatível com outras implementações para esses tipos
+    name = "msgpack"
+    id = 1
+
+    def encode(self, obj: Any) -> bytes:
+        out = bytearray()
+        self._pack(obj, out)
+        return bytes(out)
+
+    def decode(self, data: bytes) -> Any:
+        try:
+            obj, pos = self._unpack(memoryview(data), 0)
+        except (IndexError, struct.error) as exc:
+            raise ValueError("msgpack truncado") from exc
+        except TypeError as exc:
+            # chave de map não hashable (array ou map)
+            raise ValueError("chave de map msgpack inválida") from exc
+        if pos != len(data):
+            raise ValueError("bytes extras após o objeto msgpack")
+        return obj
+
+    def _pack(self, obj: Any, out: bytearray) -> None:
+        if obj is None:
+            out.append(0xC0)
+        elif obj is True:
+            out.append(0xC3)
+        elif obj is False:
+            out.append(0xC2)
+        elif isinstance(obj, int):
+            self._pack_int(obj, out)
+        elif isinstance(obj, float):
+            out.append(0xCB)
+            out += struct.pack("!d", obj)
+        elif isinstance(obj, str):
+            data = obj.encode("utf-8")
+            n = len(data)
+            if n < 32:
+                out.append(0xA0 | n)
+            elif n < 0x100:
+                out += struct.pack("!BB", 0xD9, n)
+            elif n < 0x10000:
+                out += struct.pack("!BH", 0xDA, n)
+            else:
+                out += struct.pack("!BI", 0xDB, n)
+            out += data
+        elif isinstance(obj, (bytes, bytearray, memoryview)):
+            n = len(obj)
+            if n < 0x100:
+                out += struct.pack("!BB", 0xC4, n)
+            elif n < 0x10000:
+                out += struct.pack("!BH", 0xC5, n)
+            else:
+                out += struct.pack("!BI", 0xC6, n)
+            out += obj
+        elif isinstance(obj, (list, tuple)):
+            n = len(obj)
+            if n < 16:
+                out.append(0x90 | n)
+            elif n < 0x10000:
+                out += struct.pack("!BH", 0xDC, n)
+            else:
+                out += struct.pack("!BI", 0xDD, n)
+            for item in obj:
+                self._pack(item, out)
+        elif isinstance(obj, dict):
+            n = len(obj)
+            if n < 16:
+                out.append(0x80 | n)
+            elif n < 0x10000:
+                out += struct.pack("!BH", 0xDE, n)
+            else:
+                out += struct.pack("!BI", 0xDF, n)
+            for key, value in obj.items():
+                self._pack(key, out)
+                self._pack(value, out)
+        else:
+            raise TypeError(f"tipo não suportado pelo msgpack: {type(obj).__name__}")
+
+    @staticmethod
+    def _pack_int(n: int, out: bytearray) -> None:
+        if 0 <= n < 0x80:
+            out.append(n)
+        elif -32 <= n < 0:
+            out += struct.pack("!b", n)
+        elif n >= 0:
+            if n < 0x100:
+                out += struct.pack("!BB", 0xCC, n)
+            elif n < 0x10000:
+                out += struct.pack("!BH", 0xCD, n)
+            elif n < 0x100000000:
+                out += struct.pack("!BI", 0xCE, n)
+            else:
+                out += struct.pack("!BQ", 0xCF, n)
+        else:
+            if n >= -0x80:
+                out += struct.pack("!Bb", 0xD0, n)
+            elif n >= -0x8000:
+                out += struct.pack("!Bh", 0xD1, n)
+            elif n >= -0x80000000:
+                out += struct.pack("!Bi", 0xD2, n)
+            else:
+                out += struct.pack("!Bq", 0xD3, n)
+
+    # formato -> (struct do tamanho/valor) para os tipos de largura fixa
+    _FIXED = {
+        0xCA: struct.Struct("!f"),
+        0xCB: struct.Struct("!d"),
+        0xCC: struct.Struct("!B"),
+        0xCD: struct.Struct("!H"),
+        0xCE: struct.Struct("!I"),
+        0xCF: struct.Struct("!Q"),
+        0xD0: struct.Struct("!b"),
+        0xD1: struct.Struct("!h"),
+        0xD2: struct.Struct("!i"),
+        0xD3: struct.Struct("!q"),
+    }
+    _LEN = {1: struct.Struct("!B"), 2: struct.Struct("!H"), 4: struct.Struct("!I")}
+
+    def _unpack(self, data: memoryview, pos: int) -> tuple[Any, int]:
+        b = data[pos]
+        pos += 1
+        if b < 0x80:
+            return b, pos
+        if b >= 0xE0:
+            return b - 0x100, pos
+        if 0xA0 <= b <= 0xBF:
+            return self._str(data, pos, b & 0x1F)
+        if 0x90 <= b <= 0x9F:
+            return self._array(data, pos, b & 0x0F)
+        if 0x80 <= b <= 0x8F:
+            return self._map(data, pos, b & 0x0F)
+        if b == 0xC0:
+            return None, pos
+        if b == 0xC2:
+            return False, pos
+        if b == 0xC3:
+            return True, pos
+        fixed = self._FIXED.get(b)
+        if fixed is not None:
+            return fixed.unpack_from(data, pos)[0], pos + fixed.size
+        if b in (0xD9, 0xDA, 0xDB):
+            n, pos = self._length(data, pos, {0xD9: 1, 0xDA: 2, 0xDB: 4}[b])
+            return self._str(data, pos, n)
+        if b in (0xC4, 0xC5, 0xC6):
+            n, pos = self._length(data, pos, {0xC4: 1, 0xC5: 2, 0xC6: 4}[b])
+            if pos + n > len(data):
+                raise ValueError("msgpack truncado")
+            return bytes(data[pos : pos + n]), pos + n
+        if b in (0xDC, 0xDD):
+            n, pos = self._length(data, pos, 2 if b == 0xDC else 4)
+            return self._array(data, pos, n)
+        if b in (0xDE, 0xDF):
+            n, pos = self._length(data, pos, 2 if b == 0xDE else 4)
+            return self._map(data, pos, n)
+        raise ValueError(f"formato msgpack não suportado: 0x{b:02x}")
+
+    def _length(self, data: memoryview, pos: int, width: int) -> tuple[int, int]:
+        return self._LEN[width].unpack_from(data, pos)[0], pos + width
+
+    @staticmethod
+    def _str(data: memoryview, pos: int, n: int) -> tuple[str, int]:
+        if pos + n > len(data):
+            raise ValueError("msgpack truncado")
+        return str(data[pos : pos + n], "utf-8"), pos + n
+
+    def _array(self, data: memoryview, pos: int, n: int) -> tuple[list, int]:
+        items = []
+        for _ in range(n):
+            item, pos = self._unpack(data, pos)
+            items.append(item)
+        return items, pos
+
+    def _map(self, data: memoryview, pos: int, n: int) -> tuple[dict, int]:
+        result = {}
+        for _ in range(n):
+            key, pos = self._unpack(data, pos)
+            value, pos = self._unpack(data, pos)
+            result[key] = value
+        return result, pos
+
+
+CODECS: Dict[str, Codec] = {
+    c.name: c for c in (JsonCodec(), MsgPackCodec(), RawCodec())
+}
+CODECS_BY_ID: Dict[int, Codec] = {c.id: c for c in CODECS.values()}
+# codec implícito dos frames sem o campo (protocolo 1, brokers e peers antigos):
+# continua JSON para não quebrar quem não conhece os outros
+DEFAULT_CODEC = "json"
+# o que os clientes usam ao publicar quando a conexão negocia o protocolo 2
+BINARY_CODEC = "msgpack"
+
+
+def get_codec(name: Optional[str]) -> Codec:
+    codec = CODECS.get(name or DEFAULT_CODEC)
+    if codec is None:
+        raise ValueError(f"codec desconhecido: {name}")
+    return codec
+
+
+def register_codec(codec: Codec) -> None:
+    if codec.id in CODECS_BY_ID and CODECS_BY_ID[codec.id].name != codec.name:
+        raise ValueError(f"id de codec já em uso: {codec.id}")
+    CODECS[codec.name] = codec
+    CODECS_BY_ID[codec.id] = codec
+
+
+def encode_envelope(
+    payload: Any, headers: Optional[Dict[str, str]], codec: str
+) -> bytes:
+    c = get_codec(codec)
+    if not c.envelope:
+        return c.encode(payload)
+    return c.encode({"payload": payload, "headers": headers or {}})
+
+
+def decode_envelope(data: bytes, codec: str) -> dict:
+    c = get_codec(codec)
+    if not c.envelope:
+        return {"payload": c.decode(data), "headers": {}}
+    obj = c.decode(data)
+    if not isinstance(obj, dict):
+        raise ValueError("envelope precisa ser um objeto {payload, headers}")
+    return obj
+
+
+def transcode(data: bytes, src: str, dst: str) -> tuple[bytes, str]:
+    # codecs sem envelope não podem ser convertidos: seguem como vieram
+    if src == dst or not get_codec(src).envelope or not get_codec(dst).envelope:
+        return data, src
+    return get_codec(dst).encode(get_codec(src).decode(data)), dst
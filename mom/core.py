@@ -2,10 +2,25 @@ from threading import Lock
 from typing import Set
 from dataclasses import dataclass
 from typing import Any, Dict, Optional
-import json
+import itertools
+import time
+import traceback
+import zlib
 from queue import Queue
-from threading import Thread
-from typing import Callable
+from threading import Thread, Condition
+from typing import Callable, Container, Sequence
+from collections import OrderedDict, deque
+
+from codec import DEFAULT_CODEC, decode_envelope, encode_envelope
+from filters import Filter, FilterIndex, field_path, lookup
+from framing import EncodedMessage
+from topics import (
+    MULTI_LEVEL,
+    SINGLE_LEVEL,
+    TopicTrie,
+    matches,
+    validate_pattern,
+)
 
 
 @dataclass(frozen=True)
@@ -13,72 +28,706 @@ class Message:
     topic: str
     payload: Any
     headers: Optional[Dict[str, str]] = None
+    # corpo já codificado (modo pass-through): o broker não decodifica nem re-codifica
+    body: Optional[bytes] = None
+    codec: str = DEFAULT_CODEC
+    # time.monotonic() na chegada ao broker (0.0: desconhecido)
+    received: float = 0.0
+    # publicada em outro broker e repassada por um link de peer
+    relayed: bool = False
+    # tracing.Trace quando a mensagem caiu na amostra de rastreio
+    trace: Any = None
 
 
 class Marshaller:
     @staticmethod
     def encode(msg: Message) -> bytes:
-        data = {
-            "payload": msg.payload,
-            "headers": msg.headers or {},
-        }
-        return json.dumps(data).encode("utf-8")
+        if msg.body is not None:
+            return msg.body
+        return encode_envelope(msg.payload, msg.headers, msg.codec)
+
+    @staticmethod
+    def decode(data: bytes, codec: str = DEFAULT_CODEC) -> dict:
+        return decode_envelope(data, codec)
 
     @staticmethod
-    def decode(data: bytes) -> dict:
-        obj = json.loads(data.decode("utf-8"))
-        return obj
+    def document(msg: Message) -> dict:
+        # envelope {payload, headers} sobre o qual os filtros de conteúdo rodam
+        if msg.body is None:
+            return {"payload": msg.payload, "headers": msg.headers or {}}
+        try:
+            return decode_envelope(msg.body, msg.codec)
+        except ValueError:
+            return {}
 
 
 # Parte II Step 3: SubscriptionManager Step IV: Broker (socket) Step V: Client e teste pub/sub
 
 
+class _Snapshot:
+    __slots__ = ("trie", "cache", "filters")
+
+    def __init__(self, trie: TopicTrie) -> None:
+        self.trie = trie
+        self.cache: dict[str, tuple[object, ...]] = {}
+        self.filters: dict[str, Optional[FilterIndex]] = {}
+
+
+class Subscription:
+    __slots__ = ("client", "filter", "conflate", "_path")
+
+    def __init__(
+        self,
+        client: object,
+        filter: Optional[Filter] = None,
+        conflate: Optional[str] = None,
+    ) -> None:
+        # entra na trie no lugar do cliente quando o SUB tem opções: só recebe o
+        # que passa no filtro; com conflate, mensagens ainda na fila do cliente
+        # com a mesma chave (tópico ou tópico + campo) são trocadas pela mais nova
+        self.client = client
+        self.filter = filter
+        self.conflate = conflate
+        self._path: Optional[tuple[str, ...]] = None
+        if conflate is not None and conflate != "topic":
+            self._path = field_path(conflate)
+
+    def conflation_key(self, topic: str, doc: Callable[[], dict]) -> Any:
+        if self.conflate is None:
+            return None
+        if self._path is None:
+            return topic
+        value = lookup(doc(), self._path, None)
+        try:
+            hash(value)
+        except TypeError:
+            return None
+        return None if value is None else (topic, value)
+
+
+GROUP_STRATEGIES = ("round_robin", "least_inflight")
+
+
+class SubscriberGroup:
+    def __init__(
+        self,
+        name: str,
+        pattern: str,
+        strategy: str = "round_robin",
+        load_fn: Optional[Callable[[object], int]] = None,
+    ) -> None:
+        if strategy not in GROUP_STRATEGIES:
+            raise ValueError(f"estratégia de grupo desconhecida: {strategy}")
+        # entra na trie como um único inscrito; cada mensagem vai a um só membro
+        self.name = name
+        self.pattern = pattern
+        self._strategy = strategy
+        self._load_fn = load_fn
+        # tupla trocada inteira a cada entrada/saída: pick() lê sem lock
+        self.members: tuple[object, ...] = ()
+        self._next = itertools.count()
+
+    def pick(self) -> Optional[object]:
+        members = self.members
+        if not members:
+            return None
+        start = next(self._next)
+        if self._strategy == "round_robin" or self._load_fn is None:
+            return members[start % len(members)]
+        # menor carga; o início rotativo desempata entre membros ociosos
+        best, best_load = None, 0
+        for i in range(len(members)):
+            member = members[(start + i) % len(members)]
+            load = self._load_fn(member)
+            if best is None or load < best_load:
+                best, best_load = member, load
+        return best
+
+
 class SubscriptionManager:
-    def __init__(self) -> None:
-        self._subs: dict[str, Set[object]] = {}
+    CACHE_SIZE = 10000
+
+    def __init__(self, load_fn: Optional[Callable[[object], int]] = None) -> None:
+        self._snapshot = _Snapshot(TopicTrie())
+        # índice reverso cliente -> padrão -> entrada na trie (o próprio cliente
+        # ou uma Subscription), usado só pelos escritores
+        self._by_client: dict[object, dict[str, object]] = {}
+        # grupos por (nome, padrão) e índice reverso cliente -> grupos
+        self._groups: dict[tuple[str, str], SubscriberGroup] = {}
+        self._groups_of: dict[object, Set[tuple[str, str]]] = {}
+        self._load_fn = load_fn
+        self._lock = Lock()
+
+    def add(
+        self,
+        topic: str,
+        client: object,
+        group: Optional[str] = None,
+        strategy: str = "round_robin",
+        filter: Optional[Filter] = None,
+        conflate: Optional[str] = None,
+    ) -> None:
+        validate_pattern(topic)
+        if group is not None:
+            self._join(topic, client, group, strategy)
+            return
+        with self._lock:
+            topics = self._by_client.setdefault(client, {})
+            old = topics.get(topic)
+            if (
+                old is not None
+                and getattr(old, "filter", None) is filter
+                and getattr(old, "conflate", None) == conflate
+            ):
+                return
+            # novo SUB no mesmo padrão troca as opções anteriores
+            entry = client
+            if filter is not None or conflate is not None:
+                entry = Subscription(client, filter, conflate)
+            topics[topic] = entry
+            trie = self._snapshot.trie
+            if old is not None:
+                trie = trie.remove(topic, old)
+            self._snapshot = _Snapshot(trie.add(topic, entry))
+
+    def _join(self, topic: str, client: object, group: str, strategy: str) -> None:
+        key = (group, topic)
+        with self._lock:
+            g = self._groups.get(key)
+            if g is None:
+                # a estratégia é a do primeiro membro
+                g = SubscriberGroup(group, topic, strategy, self._load_fn)
+                self._groups[key] = g
+                self._snapshot = _Snapshot(self._snapshot.trie.add(topic, g))
+            if client in g.members:
+                return
+            g.members = g.members + (client,)
+            self._groups_of.setdefault(client, set()).add(key)
+
+    def _leave(
+        self, key: tuple[str, str], client: object, trie: TopicTrie
+    ) -> TopicTrie:
+        g = self._groups[key]
+        g.members = tuple(m for m in g.members if m is not client)
+        if g.members:
+            return trie
+        del self._groups[key]
+        return trie.remove(g.pattern, g)
+
+    def remove(self, topic: str, client: object, group: Optional[str] = None) -> None:
+        if group is not None:
+            with self._lock:
+                keys = self._groups_of.get(client)
+                if not keys or (group, topic) not in keys:
+                    return
+                keys.discard((group, topic))
+                if not keys:
+                    del self._groups_of[client]
+                trie = self._leave((group, topic), client, self._snapshot.trie)
+                self._snapshot = _Snapshot(trie)
+            return
+        with self._lock:
+            topics = self._by_client.get(client)
+            if not topics or topic not in topics:
+                return
+            entry = topics.pop(topic)
+            if not topics:
+                del self._by_client[client]
+            self._snapshot = _Snapshot(self._snapshot.trie.remove(topic, entry))
+
+    def remove_client(self, client: object) -> None:
+        with self._lock:
+            topics = self._by_client.pop(client, None)
+            keys = self._groups_of.pop(client, None)
+            if not topics and not keys:
+                return
+            trie = self._snapshot.trie
+            for topic, entry in (topics or {}).items():
+                trie = trie.remove(topic, entry)
+            for key in keys or ():
+                trie = self._leave(key, client, trie)
+            self._snapshot = _Snapshot(trie)
+
+    def topics_of(self, client: object) -> frozenset[str]:
+        with self._lock:
+            return frozenset(self._by_client.get(client, ()))
+
+    def patterns(self, exclude: Container[object] = ()) -> frozenset[str]:
+        # padrões com pelo menos um inscrito fora de exclude (interesse local)
+        with self._lock:
+            found = {
+                topic
+                for client, topics in self._by_client.items()
+                if client not in exclude
+                for topic in topics
+            }
+            found.update(
+                g.pattern
+                for g in self._groups.values()
+                if any(m not in exclude for m in g.members)
+            )
+        return frozenset(found)
+
+    def get(self, topic: str) -> tuple[object, ...]:
+        # leitura sem lock: o snapshot nunca é alterado, só substituído
+        snap = self._snapshot
+        cached = snap.cache.get(topic)
+        if cached is None:
+            cached = tuple(snap.trie.match(topic))
+            if len(snap.cache) >= self.CACHE_SIZE:
+                snap.cache.clear()
+            snap.cache[topic] = cached
+        return cached
+
+    def filter_index(
+        self, topic: str, subs: Sequence[object]
+    ) -> Optional[FilterIndex]:
+        # predicados de todos os inscritos filtrados do tópico, indexados juntos;
+        # só vai para o cache se subs veio do snapshot atual
+        snap = self._snapshot
+        current = snap.cache.get(topic) is subs
+        if current and topic in snap.filters:
+            return snap.filters[topic]
+        filters = {
+            s.filter
+            for s in subs
+            if isinstance(s, Subscription) and s.filter is not None
+        }
+        index = FilterIndex(filters) if filters else None
+        if current:
+            if len(snap.filters) >= self.CACHE_SIZE:
+                snap.filters.clear()
+            snap.filters[topic] = index
+        return index
+
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest", "disconnect")
+
+
+class _Slot:
+    __slots__ = ("item", "key", "tag")
+
+    def __init__(self, item: Any, key: Any, tag: Any) -> None:
+        self.item = item
+        self.key = key
+        self.tag = tag
+
+
+class _Kept:
+    __slots__ = ("item",)
+
+    def __init__(self, item: Any) -> None:
+        self.item = item
+
+
+class Outbox:
+    def __init__(
+        self,
+        maxsize: int = 1000,
+        policy: str = "block",
+        on_dequeue: Optional[Callable[[float, float, Any, Any], None]] = None,
+    ) -> None:
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"política de overflow desconhecida: {policy}")
+        self._items: "deque[Any]" = deque()
+        self._maxsize = maxsize
+        self._policy = policy
+        self._cond = Condition()
+        self._closed = False
+        # itens com chave de conflação ainda na fila
+        self._keyed: Dict[Any, _Slot] = {}
+        # com on_dequeue: (instante do put, origem, trace, tag) de cada item, na
+        # mesma ordem; on_dequeue(espera no outbox, origem, trace, tag) é chamado
+        # na saída, só para o que sai de fato (nem descartado nem substituído)
+        self._on_dequeue = on_dequeue
+        self._times: "deque[tuple[float, float, Any, Any]]" = deque()
+        self.dropped = 0
+        self.conflated = 0
+
+    def put(
+        self,
+        item: Any,
+        wait: bool = False,
+        force: bool = False,
+        key: Any = None,
+        origin: float = 0.0,
+        trace: Any = None,
+        keep: bool = False,
+        tag: Any = None,
+    ) -> bool:
+        # False significa que a conexão deve ser derrubada;
+        # wait=True espera por espaço independentemente da política (replay);
+        # force=True ignora o limite (frames de controle, thread do event loop);
+        # key: substitui, na mesma posição, o item pendente com a mesma chave;
+        # keep=True: drop_oldest nunca descarta o item (fragmentos de stream);
+        # tag vai para o on_dequeue quando o item sai
+        with self._cond:
+            if self._closed:
+                return False
+            if key is not None:
+                slot = self._keyed.get(key)
+                if slot is not None:
+                    slot.item = item
+                    slot.tag = tag
+                    self.conflated += 1
+                    return True
+            if len(self._items) >= self._maxsize and not force:
+                if wait or self._policy == "block":
+                    while len(self._items) >= self._maxsize and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        return False
+                elif self._policy == "drop_oldest":
+                    self.dropped += 1
+                    if not self._drop_oldest():
+                        # só há itens que não podem sair: descarta o novo
+                        return True
+                elif self._policy == "drop_newest":
+                    self.dropped += 1
+                    return True
+                else:
+                    return False
+            if key is not None:
+                # a chave pode ter entrado enquanto esperávamos por espaço
+                slot = self._keyed.get(key)
+                if slot is not None:
+                    slot.item = item
+                    slot.tag = tag
+                    self.conflated += 1
+                    return True
+                item = self._keyed[key] = _Slot(item, key, tag)
+            elif keep:
+                item = _Kept(item)
+            self._items.append(item)
+            if self._on_dequeue is not None:
+                self._times.append((time.monotonic(), origin, trace, tag))
+            self._cond.notify_all()
+            return True
+
+    def full(self) -> bool:
+        return not self._closed and len(self._items) >= self._maxsize
+
+    def wait_space(self) -> None:
+        # espera a fila ficar abaixo do limite (ou ser fechada), sem enfileirar
+        with self._cond:
+            while len(self._items) >= self._maxsize and not self._closed:
+                self._cond.wait()
+
+    def get(self, block: bool = True) -> Optional[Any]:
+        times: list[tuple[float, float, Any, Any]] = []
+        with self._cond:
+            while block and not self._items and not self._closed:
+                self._cond.wait()
+            if not self._items:
+                return None
+            item = self._pop(times)
+            self._cond.notify_all()
+        self._report(times)
+        return item
+
+    def drain(self, max_items: int) -> list[Any]:
+        times: list[tuple[float, float, Any, Any]] = []
+        with self._cond:
+            n = min(max_items, len(self._items))
+            items = [self._pop(times) for _ in range(n)]
+            if items:
+                self._cond.notify_all()
+        self._report(times)
+        return items
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._items.clear()
+            self._keyed.clear()
+            self._times.clear()
+            self._cond.notify_all()
+
+    def _pop(self, times: Optional[list[tuple[float, float, Any, Any]]]) -> Any:
+        item = self._items.popleft()
+        stamp = self._times.popleft() if self._on_dequeue is not None else None
+        if isinstance(item, _Slot):
+            del self._keyed[item.key]
+            if stamp is not None:
+                # a tag do item que substituiu o original
+                stamp = stamp[:3] + (item.tag,)
+            item = item.item
+        elif isinstance(item, _Kept):
+            item = item.item
+        if stamp is not None and times is not None:
+            times.append(stamp)
+        return item
+
+    def _drop_oldest(self) -> bool:
+        # o mais antigo que pode ser descartado (quase sempre o primeiro)
+        for i, item in enumerate(self._items):
+            if isinstance(item, _Kept):
+                continue
+            del self._items[i]
+            if self._on_dequeue is not None:
+                del self._times[i]
+            if isinstance(item, _Slot):
+                del self._keyed[item.key]
+            return True
+        return False
+
+    def _report(self, times: list[tuple[float, float, Any, Any]]) -> None:
+        if not times or self._on_dequeue is None:
+            return
+        now = time.monotonic()
+        for enqueued, origin, trace, tag in times:
+            self._on_dequeue(now - enqueued, origin, trace, tag)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class InflightWindow:
+    def __init__(
+        self,
+        size: int,
+        timeout: float,
+        waiting: Outbox,
+        send: Callable[[bytes, Any], bool],
+    ) -> None:
+        # entrega at-least-once: no máximo `size` mensagens sem ACK por subscriber;
+        # o excedente espera em `waiting`, que segue a política de overflow.
+        # send(frame, tag) recebe a tag do offer a cada envio (e reenvio)
+        self._size = size
+        self._timeout = timeout
+        self._waiting = waiting
+        self._send = send
+        self._inflight: "OrderedDict[int, list]" = OrderedDict()
         self._lock = Lock()
+        self.redelivered = 0
 
-    def add(self, topic: str, client: object) -> None:
+    def offer(
+        self,
+        msg_id: int,
+        frame: bytes,
+        force: bool = False,
+        key: Any = None,
+        tag: Any = None,
+    ) -> bool:
+        with self._lock:
+            if len(self._inflight) < self._size and not len(self._waiting):
+                return self._start(msg_id, frame, tag)
+        if not self._waiting.put((msg_id, frame, tag), force=force, key=key):
+            return False
         with self._lock:
-            self._subs.setdefault(topic, set()).add(client)
+            return self._promote()
 
-    def remove(self, topic: str, client: object) -> None:
+    def ack(self, msg_id: int) -> bool:
         with self._lock:
-            if topic in self._subs:
-                self._subs[topic].discard(client)
-                if not self._subs[topic]:
-                    del self._subs[topic]
+            self._inflight.pop(msg_id, None)
+            return self._promote()
 
-    def get(self, topic: str) -> list[object]:
+    def redeliver(self, now: float) -> bool:
         with self._lock:
-            return list(self._subs.get(topic, ()))
+            for entry in self._inflight.values():
+                if entry[0] <= now:
+                    entry[0] = now + self._timeout
+                    self.redelivered += 1
+                    if not self._send(entry[1], entry[2]):
+                        return False
+        return True
+
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+    def backlog(self) -> int:
+        # sem ACK mais esperando vaga na janela
+        return len(self._inflight) + len(self._waiting)
+
+    def full(self) -> bool:
+        return self._waiting.full()
+
+    def wait_space(self) -> None:
+        self._waiting.wait_space()
+
+    def close(self) -> None:
+        self._waiting.close()
+
+    def _start(self, msg_id: int, frame: bytes, tag: Any = None) -> bool:
+        # envio sob o lock: a ordem de entrada na janela é a ordem no socket
+        self._inflight[msg_id] = [time.monotonic() + self._timeout, frame, tag]
+        return self._send(frame, tag)
+
+    def _promote(self) -> bool:
+        while len(self._inflight) < self._size:
+            item = self._waiting.get(block=False)
+            if item is None:
+                break
+            if not self._start(*item):
+                return False
+        return True
+
+
+class RetainedCache:
+    def __init__(
+        self, max_topics: int = 10000, max_bytes: int = 64 * 1024 * 1024
+    ) -> None:
+        # último frame por tópico, com despejo LRU por quantidade e por bytes.
+        # Guarda só tópico, corpo e codec (o que o limite de bytes conta) e
+        # entrega cópias: os frames montados para cada inscrito não ficam aqui
+        self._frames: "OrderedDict[str, EncodedMessage]" = OrderedDict()
+        self._max_topics = max_topics
+        self._max_bytes = max_bytes
+        self._bytes = 0
+        self._lock = Lock()
+
+    def put(self, topic: str, frame: EncodedMessage) -> None:
+        frame = frame.stripped()
+        with self._lock:
+            old = self._frames.pop(topic, None)
+            if old is not None:
+                self._bytes -= len(old)
+            if len(frame) > self._max_bytes:
+                return
+            self._frames[topic] = frame
+            self._bytes += len(frame)
+            while (
+                len(self._frames) > self._max_topics or self._bytes > self._max_bytes
+            ):
+                _, evicted = self._frames.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def get(self, topic: str) -> Optional[EncodedMessage]:
+        with self._lock:
+            frame = self._frames.get(topic)
+            if frame is None:
+                return None
+            self._frames.move_to_end(topic)
+            return frame.stripped()
+
+    def match(self, pattern: str) -> list[EncodedMessage]:
+        if SINGLE_LEVEL not in pattern and MULTI_LEVEL not in pattern:
+            frame = self.get(pattern)
+            return [frame] if frame is not None else []
+        with self._lock:
+            found = [t for t in self._frames if matches(pattern, t)]
+            for topic in found:
+                self._frames.move_to_end(topic)
+            return [self._frames[t].stripped() for t in found]
+
+    def __len__(self) -> int:
+        return len(self._frames)
 
 
 class NotificationEngine:
-    def __init__(self) -> None:
-        self.queue: "Queue[Message]" = Queue()
+    def __init__(self, shards: int = 1) -> None:
+        if shards < 1:
+            raise ValueError("shards deve ser >= 1")
+        # mesmo tópico -> mesma fila -> mesmo consumer: ordem por tópico garantida
+        self.queues: list["Queue[Message]"] = [Queue() for _ in range(shards)]
+        self.queue = self.queues[0]
+
+    def shard_of(self, topic: str) -> int:
+        if len(self.queues) == 1:
+            return 0
+        return zlib.crc32(topic.encode("utf-8")) % len(self.queues)
 
     def publish(self, message: Message) -> None:
-        self.queue.put(message)
+        self.queues[self.shard_of(message.topic)].put(message)
+
+    def depths(self) -> list[int]:
+        return [q.qsize() for q in self.queues]
 
 
 class NotificationConsumer(Thread):
     def __init__(
         self,
         engine: NotificationEngine,
-        get_subscribers: Callable[[str], list[object]],
-        send_fn: Callable[[object, Message], None],
+        get_subscribers: Callable[[str], Sequence[object]],
+        send_fn: Callable[..., None],
         daemon: bool = True,
+        encode_fn: Optional[Callable[[Message], Any]] = None,
+        shard: int = 0,
+        retain_fn: Optional[Callable[[str, Any], None]] = None,
+        get_filters: Optional[
+            Callable[[str, Sequence[object]], Optional[FilterIndex]]
+        ] = None,
     ) -> None:
-        super().__init__(daemon=daemon)
+        super().__init__(daemon=daemon, name=f"NotificationConsumer-{shard}")
         self._engine = engine
+        self._queue = engine.queues[shard]
         self._get_subscribers = get_subscribers
         self._send_fn = send_fn
+        self._encode_fn = encode_fn
+        self._retain_fn = retain_fn
+        self._get_filters = get_filters
+        # mensagens cuja entrega falhou; o consumer segue com as próximas
+        self.errors = 0
 
     def run(self) -> None:
         while True:
-            msg = self._engine.queue.get()
-            subs = self._get_subscribers(msg.topic)
-            for client in subs:
-                self._send_fn(client, msg)
-                # self._engine.queue.task_done()
+            msg = self._queue.get()
+            try:
+                self._dispatch(msg)
+            except Exception:
+                self.errors += 1
+                traceback.print_exc()
+
+    def _dispatch(self, msg: Message) -> None:
+        trace = msg.trace
+        if trace is not None:
+            trace.mark("queue")
+        out = None
+        if self._retain_fn is not None:
+            out = self._encode_fn(msg) if self._encode_fn else msg
+            self._retain_fn(msg.topic, out)
+        subs = self._get_subscribers(msg.topic)
+        if trace is not None:
+            trace.mark("lookup", subscribers=len(subs))
+        if not subs:
+            return
+        # codifica uma única vez e entrega o mesmo buffer a todos os inscritos
+        if out is None:
+            out = self._encode_fn(msg) if self._encode_fn else msg
+        # o envelope é decodificado no máximo uma vez por mensagem e cada
+        # predicado é avaliado uma vez para todos os filtros
+        doc: list[dict] = []
+        results = None
+
+        def document() -> dict:
+            if not doc:
+                doc.append(Marshaller.document(msg))
+            return doc[0]
+
+        for client in subs:
+            if isinstance(client, Subscription):
+                sub = client
+                client = sub.client
+                if sub.filter is not None:
+                    if results is None:
+                        results = self._filter_results(msg, subs, document())
+                    if not sub.filter.evaluate(results):
+                        continue
+                key = sub.conflation_key(msg.topic, document)
+                if key is not None:
+                    self._send_fn(client, out, key)
+                    continue
+            elif isinstance(client, SubscriberGroup):
+                # grupo: só um dos membros recebe
+                client = client.pick()
+                if client is None:
+                    continue
+            self._send_fn(client, out)
+            # self._engine.queue.task_done()
+        if trace is not None:
+            # filtros, encode e enfileiramento para todos os inscritos
+            trace.mark("fanout")
+
+    def _filter_results(
+        self, msg: Message, subs: Sequence[object], doc: dict
+    ) -> Dict[tuple, bool]:
+        index = None
+        if self._get_filters is not None:
+            index = self._get_filters(msg.topic, subs)
+        if index is None:
+            index = FilterIndex(
+                s.filter
+                for s in subs
+                if isinstance(s, Subscription) and s.filter is not None
+            )
+        return index.evaluate(doc)
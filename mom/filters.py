@@ -0,0 +1,234 @@
+import json
+import re
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Optional, Union
+
+# filtro de conteúdo do SUB, por exemplo:
+#   battery < 0.2 and (serviceStatus == "onRoute" or headers.prio >= 5)
+# campos sem prefixo são do payload; "headers." e "payload." são explícitos
+
+OPERATORS = ("==", "!=", "<=", ">=", "<", ">")
+_KEYWORDS = {"and", "or", "not"}
+_LITERALS = {"true": True, "false": False, "null": None}
+
+_TOKEN = re.compile(
+    r"""\s*(?:
+        (?P<num>-?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?)
+      | (?P<str>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+      | (?P<op>==|!=|<=|>=|<|>|\(|\))
+      | (?P<name>[A-Za-z_$][\w$]*(?:\.[\w$]+)*)
+    )""",
+    re.VERBOSE,
+)
+
+_MISSING = object()
+
+
+class Predicate:
+    __slots__ = ("field", "path", "op", "value")
+
+    def __init__(self, field: str, op: str, value: Any) -> None:
+        self.path = field_path(field)
+        self.field = ".".join(self.path)
+        self.op = op
+        self.value = value
+
+    @property
+    def key(self) -> tuple[str, str, Any]:
+        return (self.field, self.op, self.value)
+
+    def test(self, value: Any) -> bool:
+        # campo ausente ou tipos incomparáveis nunca casam
+        if value is _MISSING:
+            return False
+        try:
+            if self.op == "==":
+                return value == self.value
+            if self.op == "!=":
+                return value != self.value
+            if self.op == "<":
+                return value < self.value
+            if self.op == "<=":
+                return value <= self.value
+            if self.op == ">":
+                return value > self.value
+            return value >= self.value
+        except TypeError:
+            return False
+
+
+# árvore compilada: Predicate nas folhas, ("and"|"or", filhos) ou ("not", filho)
+Node = Union[Predicate, tuple]
+
+
+def field_path(field: str) -> tuple[str, ...]:
+    # campos sem prefixo são do payload
+    path = tuple(field.split("."))
+    if path[0] not in ("payload", "headers"):
+        path = ("payload",) + path
+    return path
+
+
+def lookup(doc: Any, path: tuple[str, ...], default: Any = _MISSING) -> Any:
+    for part in path:
+        if not isinstance(doc, dict) or part not in doc:
+            return default
+        doc = doc[part]
+    return doc
+
+
+class Filter:
+    def __init__(self, expression: str, tree: Node) -> None:
+        self.expression = expression
+        self._tree = tree
+        self.predicates = tuple(self._leaves(tree))
+
+    def _leaves(self, node: Node) -> Iterable[Predicate]:
+        if isinstance(node, Predicate):
+            yield node
+        else:
+            for child in node[1:]:
+                yield from self._leaves(child)
+
+    def matches(self, doc: dict) -> bool:
+        # avaliação avulsa (replay, valor retido); ao vivo usa FilterIndex
+        results = {p.key: p.test(lookup(doc, p.path)) for p in self.predicates}
+        return self.evaluate(results)
+
+    def evaluate(self, results: Dict[tuple, bool]) -> bool:
+        return self._eval(self._tree, results)
+
+    def _eval(self, node: Node, results: Dict[tuple, bool]) -> bool:
+        if isinstance(node, Predicate):
+            return results[node.key]
+        kind = node[0]
+        if kind == "not":
+            return not self._eval(node[1], results)
+        if kind == "and":
+            return all(self._eval(child, results) for child in node[1:])
+        return any(self._eval(child, results) for child in node[1:])
+
+    def __repr__(self) -> str:
+        return f"Filter({self.expression!r})"
+
+
+class _Parser:
+    def __init__(self, expression: str) -> None:
+        self._tokens = self._tokenize(expression)
+        self._pos = 0
+
+    @staticmethod
+    def _tokenize(expression: str) -> list[tuple[str, Any]]:
+        tokens = []
+        pos = 0
+        text = expression.rstrip()
+        while pos < len(text):
+            m = _TOKEN.match(text, pos)
+            if m is None:
+                raise ValueError(f"filtro inválido perto de: {text[pos:]!r}")
+            pos = m.end()
+            kind = m.lastgroup
+            raw = m.group(kind)
+            if kind == "num":
+                value = float(raw) if any(c in raw for c in ".eE") else int(raw)
+                tokens.append(("lit", value))
+            elif kind == "str":
+                if raw[0] == "'":
+                    raw = '"' + raw[1:-1].replace("\\'", "'").replace('"', '\\"') + '"'
+                tokens.append(("lit", json.loads(raw)))
+            elif kind == "name" and raw in _LITERALS:
+                tokens.append(("lit", _LITERALS[raw]))
+            elif kind == "name" and raw in _KEYWORDS:
+                tokens.append((raw, raw))
+            else:
+                tokens.append((kind, raw))
+        return tokens
+
+    def _peek(self) -> Optional[tuple[str, Any]]:
+        return self._tokens[self._pos] if self._pos < len(self._tokens) else None
+
+    def _take(self, kind: str) -> Any:
+        token = self._peek()
+        if token is None or token[0] != kind:
+            raise ValueError(f"filtro inválido: esperava {kind}")
+        self._pos += 1
+        return token[1]
+
+    def parse(self) -> Node:
+        node = self._or()
+        if self._peek() is not None:
+            raise ValueError(f"filtro inválido: sobra {self._peek()[1]!r}")
+        return node
+
+    def _or(self) -> Node:
+        children = [self._and()]
+        while self._peek() == ("or", "or"):
+            self._pos += 1
+            children.append(self._and())
+        return children[0] if len(children) == 1 else ("or", *children)
+
+    def _and(self) -> Node:
+        children = [self._unary()]
+        while self._peek() == ("and", "and"):
+            self._pos += 1
+            children.append(self._unary())
+        return children[0] if len(children) == 1 else ("and", *children)
+
+    def _unary(self) -> Node:
+        token = self._peek()
+        if token == ("not", "not"):
+            self._pos += 1
+            return ("not", self._unary())
+        if token == ("op", "("):
+            self._pos += 1
+            node = self._or()
+            if self._take("op") != ")":
+                raise ValueError("filtro inválido: esperava ')'")
+            return node
+        field = self._take("name")
+        op = self._take("op")
+        if op not in OPERATORS:
+            raise ValueError(f"operador inválido no filtro: {op}")
+        return Predicate(field, op, self._take("lit"))
+
+
+@lru_cache(maxsize=1024)
+def compile_filter(expression: str) -> Filter:
+    # expressões iguais viram o mesmo Filter (e os mesmos predicados)
+    return Filter(expression, _Parser(expression).parse())
+
+
+class FilterIndex:
+    def __init__(self, filters: Iterable[Filter]) -> None:
+        # montado uma vez por tópico: cada campo é lido uma vez por mensagem e
+        # igualdades no mesmo campo viram uma busca num dicionário
+        self._fields: Dict[tuple[str, ...], tuple[Dict[Any, list], list]] = {}
+        seen = set()
+        for f in filters:
+            for p in f.predicates:
+                if p.key in seen:
+                    continue
+                seen.add(p.key)
+                equals, others = self._fields.setdefault(p.path, ({}, []))
+                if p.op == "==":
+                    equals.setdefault(p.value, []).append(p.key)
+                else:
+                    others.append(p)
+        self._keys = seen
+
+    def evaluate(self, doc: dict) -> Dict[tuple, bool]:
+        results = dict.fromkeys(self._keys, False)
+        for path, (equals, others) in self._fields.items():
+            value = lookup(doc, path)
+            if value is _MISSING:
+                continue
+            if equals:
+                try:
+                    for key in equals.get(value, ()):
+                        results[key] = True
+                except TypeError:
+                    # valor não hashable (lista, dict) nunca é igual a um literal
+                    pass
+            for p in others:
+                results[p.key] = p.test(value)
+        return results
@@ -0,0 +1,433 @@
+import re
+import socket
+import struct
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence
+
+from codec import CODECS_BY_ID, DEFAULT_CODEC, get_codec, transcode
+
+# comandos que carregam corpo -> índice do argumento com o tamanho em bytes
+BODY_COMMANDS = {"PUB": 2, "MSG": 2, "MPUB": 2, "CHUNK": 2}
+
+# protocolo v2 (binário), negociado com "HELLO 2\n" logo após conectar:
+# opcode, flags (id do codec), tamanho do tópico, tamanho do corpo;
+# depois tópico, id da mensagem (8 bytes, só com FLAG_ID) e corpo
+PROTOCOL_VERSION = 2
+HEADER = struct.Struct("!BBHI")
+MSG_ID = struct.Struct("!Q")
+FLAG_ID = 0x80
+OPCODES = {
+    "SUB": 1,
+    "PUB": 2,
+    "MSG": 3,
+    "MPUB": 4,
+    "ACK": 5,
+    "CREDIT": 6,
+    "STATS": 7,
+    "UNSUB": 8,
+    "PEER": 9,
+    "CHUNK": 10,
+}
+COMMANDS = {op: cmd for cmd, op in OPCODES.items()}
+# item de MPUB no v2: tamanho do tópico, tamanho do corpo
+BATCH_ITEM = struct.Struct("!HI")
+
+# parts: comando e tópico (str); nos comandos com corpo, já tipados nos dois
+# protocolos: tamanho (int), codec (nome conhecido) e id/token (int)
+Frame = tuple[list[Any], bytes]
+
+# CHUNK: um fragmento de uma mensagem grande, repassado pelo broker assim que
+# chega. O campo de id leva o token (stream << 32) | (seq << 2) | flags; o
+# último fragmento tem CHUNK_LAST e CHUNK_ABORT avisa que o stream foi abandonado
+CHUNK_LAST = 0x1
+CHUNK_ABORT = 0x2
+
+
+# início da opção filter= (a expressão vai intacta até o fim)
+_FILTER_OPTION = re.compile(r"(?:^|\s)(filter=)", re.IGNORECASE)
+
+
+def split_options(text: str) -> list[str]:
+    # opções do SUB/UNSUB separadas por espaço, exceto filter=, que fica num
+    # só token com o resto do texto: literais da expressão podem ter espaços
+    match = _FILTER_OPTION.search(text)
+    if match is None:
+        return text.split()
+    return text[: match.start(1)].split() + [text[match.start(1) :]]
+
+
+def chunk_token(stream: int, seq: int, flags: int = 0) -> int:
+    return (stream << 32) | (seq << 2) | flags
+
+
+def parse_chunk_token(token: int) -> tuple[int, int, int]:
+    return token >> 32, (token >> 2) & 0x3FFFFFFF, token & 0x3
+
+
+class FrameReader:
+    MAX_LINE = 64 * 1024
+    # corpos maiores que isso são recebidos direto num buffer próprio
+    LARGE_BODY = 256 * 1024
+    # limite padrão do corpo anunciado; o buffer do corpo cresce conforme os
+    # bytes chegam, nunca pelo tamanho anunciado
+    MAX_BODY = 64 * 1024 * 1024
+
+    def __init__(self, capacity: int = 4096) -> None:
+        # começa pequeno (conexões ociosas custam pouco) e volta a esse tamanho
+        # depois de um frame grande
+        self._capacity = capacity
+        self._buf = bytearray(capacity)
+        self._start = 0
+        self._end = 0
+        self._pending: Optional[tuple[list[Any], int]] = None
+        self._body: Optional[bytearray] = None
+        self._body_len = 0
+        # passa a True depois do HELLO 2; a troca vale a partir do próximo frame
+        self.binary = False
+        # corpo anunciado acima disso (0: sem limite) é erro antes de ser lido
+        self.max_body = self.MAX_BODY
+
+    def recv_from(self, sock: socket.socket) -> int:
+        if self._body is not None and self._pending is not None:
+            size = self._pending[1]
+            if self._body_len < size:
+                self._grow_body(size)
+                n = sock.recv_into(memoryview(self._body)[self._body_len :])
+                self._body_len += n
+                return n
+        self._reserve(4096)
+        n = sock.recv_into(memoryview(self._buf)[self._end :])
+        self._end += n
+        return n
+
+    def feed(self, data: bytes) -> None:
+        # mesmo caminho do recv_from para quem lê por outra via (asyncio)
+        if self._body is not None and self._pending is not None:
+            size = self._pending[1]
+            if self._body_len < size:
+                n = min(len(data), size - self._body_len)
+                self._body[self._body_len : self._body_len + n] = data[:n]
+                self._body_len += n
+                data = data[n:]
+                if not data:
+                    return
+        self._reserve(len(data))
+        self._buf[self._end : self._end + len(data)] = data
+        self._end += len(data)
+
+    def frames(self) -> Iterator[Frame]:
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                self._shrink()
+                return
+            yield frame
+
+    def buffered(self) -> int:
+        return self._end - self._start
+
+    def _next_frame(self) -> Optional[Frame]:
+        if self.binary:
+            return self._next_binary_frame()
+        while self._pending is None:
+            idx = self._buf.find(b"\n", self._start, self._end)
+            if idx < 0:
+                if self._end - self._start > self.MAX_LINE:
+                    raise ValueError("linha de comando muito longa")
+                return None
+            line = self._buf[self._start : idx].decode("utf-8").strip()
+            self._start = idx + 1
+            if not line:
+                continue
+            parts = line.split(maxsplit=2)
+            if parts[0].upper() in ("SUB", "UNSUB") and len(parts) == 3:
+                parts = parts[:2] + split_options(parts[2])
+            elif len(parts) == 3:
+                parts = parts[:2] + parts[2].split()
+            size_idx = BODY_COMMANDS.get(parts[0].upper())
+            if size_idx is None or len(parts) <= size_idx:
+                return parts, b""
+            self._pending = (self._typed(parts), parts[size_idx])
+            self._start_body()
+        return self._take_body()
+
+    @staticmethod
+    def _typed(parts: list[Any]) -> list[Any]:
+        # cmd tópico tamanho[ codec[ id]]: os campos do texto viram os mesmos
+        # tipos que o v2 tira do header
+        parts[2] = int(parts[2])
+        if len(parts) > 3:
+            get_codec(parts[3])
+        if len(parts) > 4:
+            parts[4] = int(parts[4])
+        return parts
+
+    def _next_binary_frame(self) -> Optional[Frame]:
+        if self._pending is None:
+            avail = self._end - self._start
+            if avail < HEADER.size:
+                return None
+            opcode, flags, topic_len, body_len = HEADER.unpack_from(
+                self._buf, self._start
+            )
+            id_len = MSG_ID.size if flags & FLAG_ID else 0
+            if avail < HEADER.size + topic_len + id_len:
+                return None
+            cmd = COMMANDS.get(opcode)
+            if cmd is None:
+                raise ValueError(f"opcode desconhecido: {opcode}")
+            topic_start = self._start + HEADER.size
+            topic = self._buf[topic_start : topic_start + topic_len].decode("utf-8")
+            # mesmas parts do protocolo de texto: cmd, tópico, tamanho[, codec[, id]]
+            parts: list[Any]
+            if cmd in BODY_COMMANDS:
+                parts = [cmd, topic, body_len]
+                codec_id = flags & ~FLAG_ID
+                if codec_id or id_len:
+                    codec = CODECS_BY_ID.get(codec_id)
+                    if codec is None:
+                        raise ValueError(f"codec desconhecido: {codec_id}")
+                    parts.append(codec.name)
+                if id_len:
+                    id_start = topic_start + topic_len
+                    parts.append(MSG_ID.unpack_from(self._buf, id_start)[0])
+            else:
+                parts = [cmd, topic]
+            self._start = topic_start + topic_len + id_len
+            self._pending = (parts, body_len)
+            self._start_body()
+
+        frame = self._take_body()
+        if frame is not None and frame[0][0] in ("SUB", "UNSUB"):
+            # no v2 as opções do SUB/UNSUB viajam no corpo
+            return frame[0] + split_options(frame[1].decode("utf-8")), b""
+        return frame
+
+    def _take_body(self) -> Optional[Frame]:
+        assert self._pending is not None
+        parts, size = self._pending
+        if self._body is not None:
+            if self._body_len < size:
+                return None
+            body = bytes(self._body)
+            self._body = None
+            self._body_len = 0
+            self._pending = None
+            return parts, body
+
+        if self._end - self._start < size:
+            return None
+        body_view = memoryview(self._buf)[self._start : self._start + size]
+        body_bytes = bytes(body_view)
+        body_view.release()
+        self._start += size
+        self._pending = None
+        return parts, body_bytes
+
+    def _start_body(self) -> None:
+        assert self._pending is not None
+        size = self._pending[1]
+        if size < 0:
+            raise ValueError(f"tamanho de corpo negativo: {size}")
+        if self.max_body and size > self.max_body:
+            raise ValueError(f"corpo de {size} bytes acima do limite {self.max_body}")
+        if size < self.LARGE_BODY:
+            return
+        # copia o que já chegou e passa a receber direto no buffer do corpo,
+        # que cresce conforme os bytes chegam
+        have = min(size, self._end - self._start)
+        self._body = bytearray(memoryview(self._buf)[self._start : self._start + have])
+        self._start += have
+        self._body_len = have
+
+    def _grow_body(self, size: int) -> None:
+        assert self._body is not None
+        if len(self._body) > self._body_len:
+            return
+        step = max(len(self._body), self.LARGE_BODY)
+        self._body.extend(bytes(min(step, size - len(self._body))))
+
+    def _shrink(self) -> None:
+        # depois de um frame grande o buffer volta à capacidade inicial
+        used = self._end - self._start
+        if len(self._buf) <= self._capacity or used > self._capacity // 2:
+            return
+        buf = bytearray(self._capacity)
+        buf[:used] = self._buf[self._start : self._end]
+        self._buf = buf
+        self._start = 0
+        self._end = used
+
+    def _reserve(self, n: int) -> None:
+        if len(self._buf) - self._end >= n:
+            return
+        used = self._end - self._start
+        if self._start:
+            self._buf[:used] = self._buf[self._start : self._end]
+            self._start = 0
+            self._end = used
+        if len(self._buf) - self._end < n:
+            new_cap = len(self._buf)
+            while new_cap - used < n:
+                new_cap *= 2
+            self._buf.extend(bytes(new_cap - len(self._buf)))
+
+
+def encode_frame(
+    cmd: str,
+    topic: str,
+    body: bytes = b"",
+    binary: bool = False,
+    codec: str = DEFAULT_CODEC,
+    msg_id: Optional[int] = None,
+) -> bytes:
+    if binary:
+        topic_bytes = topic.encode("utf-8")
+        flags = get_codec(codec).id
+        id_bytes = b""
+        if msg_id is not None:
+            flags |= FLAG_ID
+            id_bytes = MSG_ID.pack(msg_id)
+        header = HEADER.pack(OPCODES[cmd], flags, len(topic_bytes), len(body))
+        return header + topic_bytes + id_bytes + body
+    if cmd in BODY_COMMANDS:
+        # o codec só aparece no header quando não é o padrão ou quando há id
+        # (compatível com leitores v1)
+        suffix = ""
+        if msg_id is not None:
+            suffix = f" {codec} {msg_id}"
+        elif codec != DEFAULT_CODEC:
+            suffix = f" {codec}"
+        return f"{cmd} {topic} {len(body)}{suffix}\n".encode("utf-8") + body
+    line = f"{cmd} {topic} {body.decode('utf-8')}" if body else f"{cmd} {topic}"
+    return f"{line}\n".encode("utf-8")
+
+
+class EncodedMessage:
+    __slots__ = (
+        "topic",
+        "codec",
+        "id",
+        "received",
+        "relayed",
+        "message",
+        "_body",
+        "_encode",
+        "_frames",
+    )
+
+    def __init__(
+        self,
+        topic: str,
+        body: Optional[bytes],
+        codec: str = DEFAULT_CODEC,
+        msg_id: Optional[int] = None,
+        received: float = 0.0,
+        relayed: bool = False,
+        encode: Optional[Callable[[], bytes]] = None,
+        message: Any = None,
+    ) -> None:
+        # um MSG codificado uma vez; o frame de cada versão/codec é montado
+        # sob demanda e reaproveitado por todos os inscritos. Com body=None o
+        # corpo só é codificado (por encode) quando alguém precisa de bytes:
+        # inscritos inproc recebem direto a mensagem original (message)
+        self.topic = topic
+        self._body = body
+        self._encode = encode
+        self.message = message
+        self.codec = codec
+        self.id = msg_id
+        self.received = received
+        # veio de outro broker: não volta para os links de peers
+        self.relayed = relayed
+        self._frames: Dict[tuple[bool, str, bool], bytes] = {}
+
+    @property
+    def body(self) -> bytes:
+        if self._body is None:
+            assert self._encode is not None
+            self._body = self._encode()
+        return self._body
+
+    def frame(
+        self, version: int = 1, codec: Optional[str] = None, with_id: bool = False
+    ) -> bytes:
+        key = (version >= 2, codec or self.codec, with_id and self.id is not None)
+        frame = self._frames.get(key)
+        if frame is None:
+            try:
+                body, actual = transcode(self.body, self.codec, key[1])
+            except TypeError:
+                # payload que o codec pedido não representa (ex.: bytes em
+                # json): segue no codec do publicador. Corpo inválido
+                # (ValueError) não tem conversão: o chamador descarta
+                body, actual = self.body, self.codec
+            msg_id = self.id if key[2] else None
+            frame = encode_frame("MSG", self.topic, body, key[0], actual, msg_id)
+            self._frames[key] = frame
+        return frame
+
+    def stripped(self) -> "EncodedMessage":
+        # só tópico, corpo e codec: sem frames em cache nem a mensagem original
+        return EncodedMessage(self.topic, self.body, self.codec)
+
+    def __len__(self) -> int:
+        return len(self.topic) + len(self.body)
+
+
+def encode_batch(
+    items: Sequence[tuple[str, bytes]],
+    binary: bool = False,
+    codec: str = DEFAULT_CODEC,
+) -> bytes:
+    # todos os itens do lote usam o mesmo codec
+    chunks = []
+    if binary:
+        for topic, data in items:
+            topic_bytes = topic.encode("utf-8")
+            chunks.append(BATCH_ITEM.pack(len(topic_bytes), len(data)))
+            chunks.append(topic_bytes)
+            chunks.append(data)
+        body = b"".join(chunks)
+        flags = get_codec(codec).id
+        return HEADER.pack(OPCODES["MPUB"], flags, 0, len(body)) + body
+
+    # MPUB <count> <size>[ codec]\n seguido de <topic> <len>\n<body> por item
+    for topic, data in items:
+        chunks.append(f"{topic} {len(data)}\n".encode("utf-8"))
+        chunks.append(data)
+    body = b"".join(chunks)
+    suffix = f" {codec}" if codec != DEFAULT_CODEC else ""
+    return f"MPUB {len(items)} {len(body)}{suffix}\n".encode("utf-8") + body
+
+
+def batch_item_size(topic: str, size: int, binary: bool = False) -> int:
+    # quanto um item ocupa no corpo do MPUB de encode_batch
+    topic_len = len(topic.encode("utf-8"))
+    if binary:
+        return BATCH_ITEM.size + topic_len + size
+    return topic_len + len(str(size)) + 2 + size
+
+
+def iter_batch(body: bytes, binary: bool = False) -> Iterator[tuple[str, bytes]]:
+    view = memoryview(body)
+    pos = 0
+    while pos < len(body):
+        if binary:
+            if pos + BATCH_ITEM.size > len(body):
+                raise ValueError("item de MPUB truncado")
+            topic_len, size = BATCH_ITEM.unpack_from(body, pos)
+            topic_start = pos + BATCH_ITEM.size
+            topic = body[topic_start : topic_start + topic_len].decode("utf-8")
+            start = topic_start + topic_len
+        else:
+            idx = body.index(b"\n", pos)
+            topic, size_str = body[pos:idx].decode("utf-8").split()
+            size = int(size_str)
+            start = idx + 1
+        end = start + size
+        if size < 0:
+            raise ValueError(f"item de MPUB com tamanho negativo: {size}")
+        if end > len(body):
+            raise ValueError("item de MPUB truncado")
+        yield topic, bytes(view[start:end])
+        pos = end
@@ -1,19 +1,23 @@
 from broker import Broker
-from client import Client
+from client import open_client
 import threading
 import time
 
 
+# tudo roda neste processo: os clientes usam o transporte inproc, sem socket
+URL = "inproc://main"
+
+
 def start_broker():
-    broker = Broker()
+    broker = Broker(listen=[URL])
     t = threading.Thread(target=broker.start, daemon=True)
     t.start()
     return broker
 
 
 def start_control_center():
-    sub = Client()
-    sub.subscribe("vehicle.WasteManagement:1.telemetry")
+    sub = open_client(URL)
+    sub.subscribe("vehicle.+.telemetry")
 
     def on_message(topic, payload):
         print("[CONTROL] chegou mensagem:")
@@ -26,7 +30,7 @@ def start_control_center():
 
 
 def simulate_vehicle():
-    pub = Client()
+    pub = open_client(URL)
 
     telem_payload = {
         "id": "vehicle:WasteManagement:1",
@@ -0,0 +1,116 @@
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Iterable, Optional
+
+# chave de contador: (métrica, rótulo), ex.: ("msgs_in", "vehicle.1.telemetry")
+Key = tuple[str, str]
+
+
+def _shard_index(n: int) -> int:
+    # TIDs são sequenciais: threads diferentes caem em shards diferentes
+    return threading.get_native_id() % n
+
+
+class Counters:
+    def __init__(self, shards: int = 16) -> None:
+        # cada thread escreve no seu shard: o lock quase nunca é disputado
+        self._shards = [
+            (threading.Lock(), defaultdict(int)) for _ in range(shards)
+        ]
+
+    def add(self, key: Key, n: int = 1) -> None:
+        lock, values = self._shards[_shard_index(len(self._shards))]
+        with lock:
+            values[key] += n
+
+    def add_all(self, items: Iterable[tuple[Key, int]]) -> None:
+        # várias métricas da mesma mensagem com uma aquisição de lock só
+        lock, values = self._shards[_shard_index(len(self._shards))]
+        with lock:
+            for key, n in items:
+                values[key] += n
+
+    def forget(self, label: str, prefix: str = "") -> None:
+        # rótulos de conexões encerradas não ficam acumulando
+        for lock, values in self._shards:
+            with lock:
+                stale = [k for k in values if k[1] == label and k[0].startswith(prefix)]
+                for key in stale:
+                    del values[key]
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        totals: Dict[str, Dict[str, int]] = defaultdict(dict)
+        for lock, values in self._shards:
+            with lock:
+                items = list(values.items())
+            for (name, label), n in items:
+                totals[name][label] = totals[name].get(label, 0) + n
+        return dict(totals)
+
+
+class Histogram:
+    # balde i guarda latências em [2^(i-1), 2^i) microssegundos
+    BUCKETS = 40
+
+    def __init__(self, shards: int = 16) -> None:
+        self._shards = [
+            (threading.Lock(), [0] * self.BUCKETS, [0.0]) for _ in range(shards)
+        ]
+
+    def observe(self, seconds: float) -> None:
+        bucket = min(max(int(seconds * 1e6), 0).bit_length(), self.BUCKETS - 1)
+        lock, counts, total = self._shards[_shard_index(len(self._shards))]
+        with lock:
+            counts[bucket] += 1
+            total[0] += seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        counts = [0] * self.BUCKETS
+        total = 0.0
+        for lock, shard_counts, shard_total in self._shards:
+            with lock:
+                for i, n in enumerate(shard_counts):
+                    counts[i] += n
+                total += shard_total[0]
+        n = sum(counts)
+        result: Dict[str, Any] = {"count": n, "mean_us": total * 1e6 / n if n else 0.0}
+        # percentis pelo limite superior do balde (erro de até 2x)
+        for name, q in (("p50_us", 0.5), ("p90_us", 0.9), ("p99_us", 0.99)):
+            result[name] = self._quantile(counts, n, q)
+        result["max_us"] = self._quantile(counts, n, 1.0)
+        return result
+
+    @staticmethod
+    def _quantile(counts: list[int], n: int, q: float) -> Optional[int]:
+        if not n:
+            return None
+        target = q * n
+        seen = 0
+        for i, c in enumerate(counts):
+            seen += c
+            if seen >= target:
+                return 1 << i
+        return 1 << (len(counts) - 1)
+
+
+class Metrics:
+    def __init__(self, shards: int = 16) -> None:
+        self.counters = Counters(shards)
+        self._shards = shards
+        self._histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str) -> Histogram:
+        h = self._histograms.get(name)
+        if h is None:
+            with self._lock:
+                h = self._histograms.setdefault(name, Histogram(self._shards))
+        return h
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "counters": self.counters.snapshot(),
+            "latency": {
+                name: h.snapshot() for name, h in list(self._histograms.items())
+            },
+        }
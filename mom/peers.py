@@ -0,0 +1,179 @@
+import socket
+import threading
+from typing import Any, Callable, Optional
+
+from codec import DEFAULT_CODEC
+from framing import (
+    CHUNK_ABORT,
+    CHUNK_LAST,
+    PROTOCOL_VERSION,
+    FrameReader,
+    chunk_token,
+    encode_frame,
+)
+from transports import connect
+
+# link de saída para outro broker: entra como um cliente comum, se identifica
+# com PEER e assina (SUB/UNSUB) só os padrões que têm inscritos locais; o outro
+# lado manda de volta as mensagens que casam, e elas são publicadas aqui como
+# repassadas (nunca voltam para outro link). Fragmentos (CHUNK) vão para
+# on_chunk com os streams abertos deste link, abortados se o link cair
+
+
+class PeerLink:
+    def __init__(
+        self,
+        address: str,
+        node: str,
+        on_message: Callable[[str, bytes, str], None],
+        on_chunk: Optional[Callable[[dict, str, bytes, str, int], None]] = None,
+        retry: float = 0.5,
+    ) -> None:
+        # address: "host:porta" (outro nó, TCP), caminho de um socket Unix
+        # (outro processo do mesmo nó) ou URL tcp:// / unix://
+        self.address = address
+        self._node = node
+        self._on_message = on_message
+        self._on_chunk = on_chunk
+        self._streams: dict[int, Any] = {}
+        self._retry = retry
+        self._sock: Optional[socket.socket] = None
+        self._binary = False
+        # interesse desejado e o que o peer já conhece (vazio enquanto caído)
+        self._wanted: frozenset[str] = frozenset()
+        self._sent: frozenset[str] = frozenset()
+        self._lock = threading.Lock()
+        # acorda o _sender quando o interesse muda ou a sessão começa
+        self._changed = threading.Condition(self._lock)
+        self._closed = threading.Event()
+        self.connected = False
+        self.relayed = 0
+
+    def start(self) -> None:
+        for target in (self._run, self._sender):
+            t = threading.Thread(target=target, daemon=True)
+            t.start()
+
+    def advertise(self, patterns: frozenset[str]) -> None:
+        # só guarda o interesse: quem escreve no socket é o _sender
+        with self._lock:
+            self._wanted = patterns
+            self._changed.notify()
+
+    def _sender(self) -> None:
+        # manda só a diferença para o que o peer já tem; o sendall fica fora do
+        # lock para um peer lento não segurar advertise. Se a sessão cair no
+        # meio, _run zera _sent e a próxima sessão recebe o anúncio completo
+        while True:
+            with self._lock:
+                while not self._closed.is_set() and (
+                    self._sock is None or self._sent == self._wanted
+                ):
+                    self._changed.wait()
+                if self._closed.is_set():
+                    return
+                sock = self._sock
+                frames = [
+                    encode_frame("UNSUB", p, binary=self._binary)
+                    for p in sorted(self._sent - self._wanted)
+                ]
+                frames += [
+                    encode_frame("SUB", p, binary=self._binary)
+                    for p in sorted(self._wanted - self._sent)
+                ]
+                self._sent = self._wanted
+            try:
+                sock.sendall(b"".join(frames))
+            except OSError:
+                # link caído: o leitor vê o erro e reconecta
+                pass
+
+    def _connect(self) -> socket.socket:
+        if "://" in self.address:
+            return connect(self.address)
+        host, sep, port = self.address.rpartition(":")
+        if sep and port.isdigit():
+            return socket.create_connection((host, int(port)))
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.address)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    @property
+    def interest(self) -> int:
+        # padrões que o peer conhece agora
+        return len(self._sent)
+
+    def _run(self) -> None:
+        # o peer pode ainda não estar no ar (ou cair): tenta de novo a cada retry
+        while not self._closed.is_set():
+            try:
+                sock = self._connect()
+            except OSError:
+                self._closed.wait(self._retry)
+                continue
+            try:
+                self._session(sock)
+            except (OSError, ValueError):
+                pass
+            finally:
+                with self._lock:
+                    self._sock = None
+                    self._sent = frozenset()
+                    self.connected = False
+                sock.close()
+                self._abort_streams()
+            self._closed.wait(self._retry)
+
+    def _session(self, sock: socket.socket) -> None:
+        reader = FrameReader()
+        sock.sendall(f"HELLO {PROTOCOL_VERSION}\n".encode("utf-8"))
+        frame = None
+        while frame is None:
+            if not reader.recv_from(sock):
+                return
+            frame = next(reader.frames(), None)
+        parts = frame[0]
+        self._binary = parts[0].upper() == "HELLO" and int(parts[1]) >= 2
+        reader.binary = self._binary
+        sock.sendall(encode_frame("PEER", self._node, binary=self._binary))
+        with self._lock:
+            self._sock = sock
+            self.connected = True
+            self._changed.notify()
+
+        while True:
+            for parts, body in reader.frames():
+                if parts[0].upper() == "MSG" and len(parts) >= 2:
+                    codec = parts[3] if len(parts) > 3 else DEFAULT_CODEC
+                    self.relayed += 1
+                    self._on_message(parts[1], body, codec)
+                elif parts[0].upper() == "CHUNK" and len(parts) >= 5:
+                    token = parts[4]
+                    if token & CHUNK_LAST:
+                        self.relayed += 1
+                    if self._on_chunk is not None:
+                        self._on_chunk(self._streams, parts[1], body, parts[3], token)
+            if not reader.recv_from(sock):
+                return
+
+    def _abort_streams(self) -> None:
+        # o outro lado não vai terminar os streams abertos na sessão que caiu
+        if self._on_chunk is None:
+            return
+        for stream in list(self._streams):
+            token = chunk_token(stream, 0, CHUNK_ABORT)
+            self._on_chunk(self._streams, "", b"", "", token)
+
+    def close(self) -> None:
+        self._closed.set()
+        with self._lock:
+            self._changed.notify()
+            if self._sock is not None:
+                try:
+                    self._sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
@@ -0,0 +1,286 @@
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import BinaryIO, Dict, Iterator, Optional
+from urllib.parse import quote, unquote
+
+# registro no .log: offset, timestamp, tamanho do corpo, flags, corpo
+RECORD = struct.Struct("!QdIB")
+# entrada no .idx (uma por registro): offset, timestamp, posição no .log
+INDEX = struct.Struct("!QdQ")
+
+# offset, timestamp, corpo, flags (o broker guarda ali o id do codec)
+Record = tuple[int, float, bytes, int]
+
+
+class _OpenFiles:
+    def __init__(self, max_open: int) -> None:
+        # segmentos com arquivos de append abertos, compartilhado pelos logs de
+        # um MessageStore: passando de max_open, o usado há mais tempo fecha
+        # os seus (e reabre no próximo append)
+        self._segments: "OrderedDict[_Segment, None]" = OrderedDict()
+        self._max_open = max_open
+        self._lock = threading.Lock()
+
+    def touch(self, seg: "_Segment") -> None:
+        with self._lock:
+            self._segments[seg] = None
+            self._segments.move_to_end(seg)
+            if len(self._segments) <= self._max_open:
+                return
+            for victim in list(self._segments):
+                if len(self._segments) <= self._max_open:
+                    break
+                # segmento no meio de um append fica para a próxima
+                if victim is not seg and victim.release():
+                    del self._segments[victim]
+
+    def forget(self, seg: "_Segment") -> None:
+        with self._lock:
+            self._segments.pop(seg, None)
+
+
+class _Segment:
+    def __init__(
+        self, directory: str, base: int, files: Optional[_OpenFiles] = None
+    ) -> None:
+        self.base = base
+        self.log_path = os.path.join(directory, f"{base:020d}.log")
+        self.idx_path = os.path.join(directory, f"{base:020d}.idx")
+        # arquivos de append: abertos no primeiro append e fechados quando o
+        # segmento é selado ou o LRU de arquivos abertos precisa da vaga
+        self._log: Optional[BinaryIO] = None
+        self._idx: Optional[BinaryIO] = None
+        self._files = files
+        self._io = threading.Lock()
+        for path in (self.log_path, self.idx_path):
+            open(path, "ab").close()
+        self.size = os.path.getsize(self.log_path)
+        self.count = os.path.getsize(self.idx_path) // INDEX.size
+        self._repair()
+
+    def _repair(self) -> None:
+        # descarta um registro final gravado pela metade (queda no meio do append)
+        while self.count:
+            _, _, pos = self._index_entry(self.count - 1)
+            with open(self.log_path, "rb") as f:
+                f.seek(pos)
+                head = f.read(RECORD.size)
+            if len(head) == RECORD.size:
+                end = pos + RECORD.size + RECORD.unpack(head)[2]
+                if end <= self.size:
+                    break
+            self.count -= 1
+        self._truncate(self.idx_path, self.count * INDEX.size)
+        if self.count:
+            _, _, pos = self._index_entry(self.count - 1)
+            with open(self.log_path, "rb") as f:
+                f.seek(pos)
+                length = RECORD.unpack(f.read(RECORD.size))[2]
+            self.size = pos + RECORD.size + length
+        else:
+            self.size = 0
+        self._truncate(self.log_path, self.size)
+
+    @staticmethod
+    def _truncate(path: str, size: int) -> None:
+        if os.path.getsize(path) != size:
+            os.truncate(path, size)
+
+    def append(
+        self, offset: int, timestamp: float, body: bytes, flags: int, fsync: bool
+    ) -> None:
+        with self._io:
+            if self._log is None or self._idx is None:
+                self._log = open(self.log_path, "ab")
+                self._idx = open(self.idx_path, "ab")
+            if self._files is not None:
+                self._files.touch(self)
+            pos = self.size
+            self._log.write(RECORD.pack(offset, timestamp, len(body), flags))
+            self._log.write(body)
+            self._idx.write(INDEX.pack(offset, timestamp, pos))
+            self._log.flush()
+            self._idx.flush()
+            if fsync:
+                os.fsync(self._log.fileno())
+                os.fsync(self._idx.fileno())
+            self.size += RECORD.size + len(body)
+            self.count += 1
+
+    def release(self) -> bool:
+        # fecha os arquivos de append; False se há um append em andamento
+        if not self._io.acquire(blocking=False):
+            return False
+        try:
+            self._close_files()
+        finally:
+            self._io.release()
+        return True
+
+    def _index_entry(self, i: int) -> tuple[int, float, int]:
+        with open(self.idx_path, "rb") as f:
+            f.seek(i * INDEX.size)
+            return INDEX.unpack(f.read(INDEX.size))
+
+    def first_after(self, timestamp: float) -> Optional[int]:
+        if not self.count:
+            return None
+        with open(self.idx_path, "rb") as f, mmap.mmap(
+            f.fileno(), self.count * INDEX.size, access=mmap.ACCESS_READ
+        ) as idx:
+            lo, hi = 0, self.count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if INDEX.unpack_from(idx, mid * INDEX.size)[1] < timestamp:
+                    lo = mid + 1
+                else:
+                    hi = mid
+        return self.base + lo if lo < self.count else None
+
+    def read(self, offset: int, end: int) -> Iterator[Record]:
+        first = max(offset, self.base) - self.base
+        last = min(end - self.base, self.count)
+        if first >= last or not self.size:
+            return
+        with open(self.idx_path, "rb") as fi, mmap.mmap(
+            fi.fileno(), self.count * INDEX.size, access=mmap.ACCESS_READ
+        ) as idx:
+            pos = INDEX.unpack_from(idx, first * INDEX.size)[2]
+        with open(self.log_path, "rb") as fl, mmap.mmap(
+            fl.fileno(), self.size, access=mmap.ACCESS_READ
+        ) as log:
+            for _ in range(first, last):
+                off, ts, length, flags = RECORD.unpack_from(log, pos)
+                start = pos + RECORD.size
+                yield off, ts, log[start : start + length], flags
+                pos = start + length
+
+    def close(self) -> None:
+        # também usado para selar: um segmento cheio não recebe mais appends
+        with self._io:
+            self._close_files()
+        if self._files is not None:
+            self._files.forget(self)
+
+    def _close_files(self) -> None:
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        if self._idx is not None:
+            self._idx.close()
+            self._idx = None
+
+
+class TopicLog:
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 64 * 1024 * 1024,
+        fsync: bool = False,
+        files: Optional[_OpenFiles] = None,
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self._dir = directory
+        self._segment_bytes = segment_bytes
+        self._fsync = fsync
+        self._files = files
+        # appends e publicação no engine acontecem sob este lock (ordem do log)
+        self.lock = threading.Lock()
+
+        bases = sorted(
+            int(name[:-4]) for name in os.listdir(directory) if name.endswith(".log")
+        )
+        self._segments = [_Segment(directory, base, files) for base in bases]
+        if not self._segments:
+            self._segments.append(_Segment(directory, 0, files))
+
+    @property
+    def next_offset(self) -> int:
+        last = self._segments[-1]
+        return last.base + last.count
+
+    def append(
+        self, body: bytes, timestamp: Optional[float] = None, flags: int = 0
+    ) -> int:
+        offset = self.next_offset
+        active = self._segments[-1]
+        if active.size >= self._segment_bytes and active.count:
+            # selado: só volta a ser aberto para leitura, pelo replay
+            active.close()
+            active = _Segment(self._dir, offset, self._files)
+            self._segments.append(active)
+        ts = time.time() if timestamp is None else timestamp
+        active.append(offset, ts, body, flags, self._fsync)
+        return offset
+
+    def offset_for_time(self, timestamp: float) -> int:
+        for seg in self._segments:
+            found = seg.first_after(timestamp)
+            if found is not None:
+                return found
+        return self.next_offset
+
+    def read(self, offset: int, end: Optional[int] = None) -> Iterator[Record]:
+        end = self.next_offset if end is None else end
+        segments = list(self._segments)
+        i = max(bisect.bisect_right([s.base for s in segments], offset) - 1, 0)
+        for seg in segments[i:]:
+            if seg.base >= end:
+                break
+            yield from seg.read(offset, end)
+
+    def close(self) -> None:
+        for seg in self._segments:
+            seg.close()
+
+
+class MessageStore:
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 64 * 1024 * 1024,
+        fsync: bool = False,
+        max_open: int = 256,
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self._dir = directory
+        self._segment_bytes = segment_bytes
+        self._fsync = fsync
+        # no máximo max_open segmentos (2 arquivos cada) abertos para append,
+        # não importa quantos tópicos existam
+        self._files = _OpenFiles(max_open)
+        self._logs: Dict[str, TopicLog] = {}
+        self._lock = threading.Lock()
+        # tópicos já no disco; o TopicLog de cada um só é criado no primeiro uso
+        self._known = {
+            unquote(name): None
+            for name in os.listdir(directory)
+            if os.path.isdir(os.path.join(directory, name))
+        }
+
+    def log(self, topic: str) -> TopicLog:
+        log = self._logs.get(topic)
+        if log is None:
+            with self._lock:
+                log = self._logs.get(topic)
+                if log is None:
+                    path = os.path.join(self._dir, quote(topic, safe=""))
+                    log = TopicLog(
+                        path, self._segment_bytes, self._fsync, self._files
+                    )
+                    self._logs[topic] = log
+                    self._known[topic] = None
+        return log
+
+    def topics(self) -> list[str]:
+        with self._lock:
+            return list(self._known)
+
+    def close(self) -> None:
+        for log in self._logs.values():
+            log.close()
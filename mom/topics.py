@@ -0,0 +1,159 @@
+from typing import Callable, Dict, FrozenSet, Iterable, Optional, Set
+
+SEPARATOR = "."
+SINGLE_LEVEL = "+"
+MULTI_LEVEL = "#"
+
+
+def validate_pattern(pattern: str) -> None:
+    levels = pattern.split(SEPARATOR)
+    for i, level in enumerate(levels):
+        if level == MULTI_LEVEL and i != len(levels) - 1:
+            raise ValueError(f"'#' só pode ser o último nível: {pattern}")
+        if level != MULTI_LEVEL and MULTI_LEVEL in level:
+            raise ValueError(f"'#' deve ocupar um nível inteiro: {pattern}")
+        if level != SINGLE_LEVEL and SINGLE_LEVEL in level:
+            raise ValueError(f"'+' deve ocupar um nível inteiro: {pattern}")
+
+
+def matches(pattern: str, topic: str) -> bool:
+    p_levels = pattern.split(SEPARATOR)
+    t_levels = topic.split(SEPARATOR)
+    for i, level in enumerate(p_levels):
+        if level == MULTI_LEVEL:
+            return True
+        if i >= len(t_levels):
+            return False
+        if level != SINGLE_LEVEL and level != t_levels[i]:
+            return False
+    return len(p_levels) == len(t_levels)
+
+
+def covers(general: str, specific: str) -> bool:
+    # todo tópico que casa com specific também casa com general
+    g_levels = general.split(SEPARATOR)
+    s_levels = specific.split(SEPARATOR)
+    for i, level in enumerate(g_levels):
+        if level == MULTI_LEVEL:
+            return True
+        if i >= len(s_levels) or s_levels[i] == MULTI_LEVEL:
+            return False
+        if level != SINGLE_LEVEL and level != s_levels[i]:
+            return False
+    return len(g_levels) == len(s_levels)
+
+
+def summarize(patterns: Iterable[str], limit: int = 0) -> FrozenSet[str]:
+    # resumo de interesse para peers: tira padrões cobertos por outros e, acima
+    # de limit, generaliza cortando níveis ("a.b.c" -> "a.#") até caber; o
+    # resumo pode casar tópicos a mais, nunca a menos
+    current = _uncovered(set(patterns))
+    depth = max((p.count(SEPARATOR) + 1 for p in current), default=0)
+    while limit and len(current) > limit and depth > 0:
+        depth -= 1
+        current = _uncovered({_truncate(p, depth) for p in current})
+    return frozenset(current)
+
+
+def _truncate(pattern: str, depth: int) -> str:
+    levels = pattern.split(SEPARATOR)
+    if len(levels) <= depth:
+        return pattern
+    return SEPARATOR.join(levels[:depth] + [MULTI_LEVEL])
+
+
+def _uncovered(patterns: Set[str]) -> Set[str]:
+    # só padrões com curinga cobrem outros
+    wild = [
+        p
+        for p in patterns
+        if SINGLE_LEVEL in p.split(SEPARATOR) or p.endswith(MULTI_LEVEL)
+    ]
+    return {
+        p for p in patterns if not any(w != p and covers(w, p) for w in wild)
+    }
+
+
+class _Node:
+    __slots__ = ("children", "subscribers")
+
+    def __init__(
+        self, children: Dict[str, "_Node"], subscribers: FrozenSet[object]
+    ) -> None:
+        # nós nunca são alterados depois de criados (trie persistente)
+        self.children = children
+        self.subscribers = subscribers
+
+
+_EMPTY = _Node({}, frozenset())
+
+
+class TopicTrie:
+    def __init__(self, root: _Node = _EMPTY) -> None:
+        self._root = root
+
+    def add(self, pattern: str, client: object) -> "TopicTrie":
+        return self._update(pattern, lambda subs: subs | {client})
+
+    def remove(self, pattern: str, client: object) -> "TopicTrie":
+        return self._update(pattern, lambda subs: subs - {client})
+
+    def _update(
+        self, pattern: str, fn: Callable[[FrozenSet[object]], FrozenSet[object]]
+    ) -> "TopicTrie":
+        # copia só os nós do caminho; o resto da árvore é compartilhado
+        root = self._path_copy(self._root, pattern.split(SEPARATOR), 0, fn)
+        return TopicTrie(root or _EMPTY)
+
+    def _path_copy(
+        self,
+        node: _Node,
+        levels: list[str],
+        i: int,
+        fn: Callable[[FrozenSet[object]], FrozenSet[object]],
+    ) -> Optional[_Node]:
+        if i == len(levels):
+            subscribers = fn(node.subscribers)
+            children = node.children
+        else:
+            child = node.children.get(levels[i], _EMPTY)
+            new_child = self._path_copy(child, levels, i + 1, fn)
+            children = dict(node.children)
+            if new_child is None:
+                children.pop(levels[i], None)
+            else:
+                children[levels[i]] = new_child
+            subscribers = node.subscribers
+        if not subscribers and not children:
+            return None
+        return _Node(children, subscribers)
+
+    def match(self, topic: str) -> Set[object]:
+        result: Set[object] = set()
+        self._collect(self._root, topic.split(SEPARATOR), 0, result)
+        return result
+
+    def _collect(
+        self, node: _Node, levels: list[str], i: int, out: Set[object]
+    ) -> None:
+        multi = node.children.get(MULTI_LEVEL)
+        if multi is not None:
+            out.update(multi.subscribers)
+        if i == len(levels):
+            out.update(node.subscribers)
+            return
+        exact = node.children.get(levels[i])
+        if exact is not None:
+            self._collect(exact, levels, i + 1, out)
+        single = node.children.get(SINGLE_LEVEL)
+        if single is not None:
+            self._collect(single, levels, i + 1, out)
+
+    def patterns(self) -> Iterable[str]:
+        stack: list[tuple[_Node, list[str]]] = [(self._root, [])]
+        while stack:
+            node, prefix = stack.pop()
+            if node.subscribers and prefix:
+                yield SEPARATOR.join(prefix)
+            for level, child in node.children.items():
+                stack.append((child, prefix + [level]))
@@ -0,0 +1,163 @@
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from metrics import Metrics
+
+# rastreio por estágio de uma amostra das mensagens: parse, store, queue,
+# lookup, encode, fanout e outbox (um por inscrito), mais sendall por lote de
+# escrita. Cada estágio vira um evento "X" do Trace Event Format (abre no
+# chrome://tracing ou no ui.perfetto.dev) e alimenta o histograma stage.<nome>
+# das métricas. Com o rastreio desligado o broker só testa "is not None".
+
+
+class Trace:
+    __slots__ = ("_tracer", "id", "topic", "_last")
+
+    def __init__(
+        self, tracer: "Tracer", trace_id: int, topic: str, start: float
+    ) -> None:
+        self._tracer = tracer
+        self.id = trace_id
+        self.topic = topic
+        self._last = start
+
+    def mark(self, stage: str, **args: Any) -> None:
+        # estágio sequencial: do fim do anterior até agora
+        now = time.monotonic()
+        self._tracer.span(stage, self._last, now, self, args)
+        self._last = now
+
+    def span(self, stage: str, start: float, end: float, **args: Any) -> None:
+        # estágio com início próprio (encode, outbox), fora da sequência
+        self._tracer.span(stage, start, end, self, args)
+
+
+class Tracer:
+    def __init__(
+        self,
+        sample_rate: float = 0.01,
+        path: str = "mom-trace.json",
+        max_bytes: int = 64 * 1024 * 1024,
+        backups: int = 3,
+        metrics: Optional[Metrics] = None,
+    ) -> None:
+        if not 0 < sample_rate <= 1:
+            raise ValueError("sample_rate deve estar em (0, 1]")
+        # uma a cada period mensagens (e lotes de escrita) é rastreada
+        self._period = max(1, round(1 / sample_rate))
+        self._messages = itertools.count()
+        self._batches = itertools.count()
+        self._path = path
+        self._max_bytes = max_bytes
+        self._backups = backups
+        self._metrics = metrics or Metrics()
+        self._pid = os.getpid()
+        # eventos prontos; o thread de manutenção do broker grava em flush()
+        self._events: "deque[Dict[str, Any]]" = deque()
+        # tid -> nome do thread; cada arquivo novo começa com todos os nomes
+        self._threads: Dict[int, str] = {}
+        self._file: Optional[Any] = None
+        self._first = True
+        self._lock = threading.Lock()
+
+    def sample(self, topic: str, start: float) -> Optional[Trace]:
+        n = next(self._messages)
+        if n % self._period:
+            return None
+        return Trace(self, n // self._period, topic, start)
+
+    def sampled(self) -> bool:
+        return next(self._batches) % self._period == 0
+
+    def span(
+        self,
+        stage: str,
+        start: float,
+        end: float,
+        trace: Optional[Trace] = None,
+        args: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self._metrics.histogram(f"stage.{stage}").observe(end - start)
+        tid = threading.get_native_id()
+        if tid not in self._threads:
+            # nome do thread na visualização
+            name = self._threads[tid] = threading.current_thread().name
+            self._events.append(self._thread_name(tid, name))
+        event_args = dict(args or {})
+        if trace is not None:
+            event_args["trace"] = trace.id
+            event_args["topic"] = trace.topic
+        self._events.append(
+            {
+                "name": stage,
+                "cat": "mom",
+                "ph": "X",
+                "ts": start * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": self._pid,
+                "tid": tid,
+                "args": event_args,
+            }
+        )
+
+    def _thread_name(self, tid: int, name: str) -> Dict[str, Any]:
+        return {
+            "name": "thread_name",
+            "ph": "M",
+            "pid": self._pid,
+            "tid": tid,
+            "args": {"name": name},
+        }
+
+    def flush(self) -> None:
+        if not self._events:
+            return
+        with self._lock:
+            if self._file is None:
+                self._open()
+            assert self._file is not None
+            chunks = []
+            while self._events:
+                event = self._events.popleft()
+                chunks.append(("[\n" if self._first else ",\n") + json.dumps(event))
+                self._first = False
+            self._file.write("".join(chunks))
+            self._file.flush()
+            if self._file.tell() >= self._max_bytes:
+                self._rotate()
+
+    def _open(self) -> None:
+        self._file = open(self._path, "w", encoding="utf-8")
+        self._first = True
+        names = [self._thread_name(tid, n) for tid, n in list(self._threads.items())]
+        self._events.extendleft(reversed(names))
+
+    def _finish(self) -> None:
+        # o arquivo fechado ganha o "]" final (o aberto é válido sem ele)
+        assert self._file is not None
+        self._file.write("[\n]\n" if self._first else "\n]\n")
+        self._file.close()
+        self._file = None
+
+    def _rotate(self) -> None:
+        # trace.json -> trace.json.1 -> trace.json.2 ...
+        self._finish()
+        for i in range(self._backups - 1, 0, -1):
+            src = f"{self._path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self._path}.{i + 1}")
+        if self._backups > 0:
+            os.replace(self._path, f"{self._path}.1")
+        else:
+            os.remove(self._path)
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            if self._file is not None:
+                self._finish()
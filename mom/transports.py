@@ -0,0 +1,101 @@
+import os
+import socket
+import threading
+from typing import Any, Dict
+
+# transportes escolhidos por URL:
+#   tcp://host:porta   rede (o padrão de Broker/Client)
+#   unix:///caminho    socket Unix, para processos na mesma máquina
+#   inproc://nome      mesmo processo: sem socket e sem serialização; o payload
+#                      publicado é o mesmo objeto entregue (não altere depois)
+
+SCHEMES = ("tcp", "unix", "inproc")
+
+
+def parse_url(url: str) -> tuple[str, Any]:
+    scheme, sep, rest = url.partition("://")
+    if not sep or not rest:
+        raise ValueError(f"URL de transporte inválida: {url}")
+    if scheme == "tcp":
+        host, _, port = rest.rpartition(":")
+        if not host or not port.isdigit():
+            raise ValueError(f"URL tcp precisa de host:porta: {url}")
+        return scheme, (host, int(port))
+    if scheme in ("unix", "inproc"):
+        return scheme, rest
+    raise ValueError(f"transporte desconhecido: {scheme}")
+
+
+def connect(url: str) -> socket.socket:
+    scheme, address = parse_url(url)
+    if scheme == "tcp":
+        return socket.create_connection(address)
+    if scheme == "unix":
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(address)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+    raise ValueError(f"{scheme}:// não usa socket")
+
+
+def listen(url: str) -> socket.socket:
+    scheme, address = parse_url(url)
+    if scheme == "tcp":
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    elif scheme == "unix":
+        # socket de uma execução anterior impede o bind
+        if os.path.exists(address):
+            os.unlink(address)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        raise ValueError(f"{scheme}:// não usa socket")
+    sock.bind(address)
+    sock.listen()
+    return sock
+
+
+# brokers com endpoint inproc neste processo, por nome
+_inproc: Dict[str, Any] = {}
+_inproc_lock = threading.Lock()
+
+
+def register_inproc(name: str, broker: Any) -> None:
+    with _inproc_lock:
+        if name in _inproc:
+            raise ValueError(f"endpoint inproc já em uso: {name}")
+        _inproc[name] = broker
+
+
+def unregister_inproc(name: str) -> None:
+    with _inproc_lock:
+        _inproc.pop(name, None)
+
+
+def lookup_inproc(name: str) -> Any:
+    with _inproc_lock:
+        broker = _inproc.get(name)
+    if broker is None:
+        raise ConnectionRefusedError(f"nenhum broker em inproc://{name}")
+    return broker
+
+
+class InprocSocket:
+    # ocupa o lugar do socket do cliente nos mapas do broker; shutdown/close
+    # avisam o broker, que derruba a conexão como faria num EOF
+    def __init__(self) -> None:
+        self.closed = False
+        self.on_close: Any = None
+
+    def shutdown(self, how: int = socket.SHUT_RDWR) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self.on_close is not None:
+            self.on_close()
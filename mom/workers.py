@@ -0,0 +1,89 @@
+import argparse
+import multiprocessing
+import os
+import tempfile
+from typing import Any, List, Optional
+
+from broker import Broker
+
+# broker em vários processos: todos escutam no mesmo host:porta (SO_REUSEPORT)
+# e cada um se liga aos outros por sockets Unix; um publish chega aos inscritos
+# de qualquer processo, mas só atravessa para os processos com interesse.
+#
+#   python workers.py --workers 4 --port 5000 --mode selector
+#
+# Cada processo tem seu próprio log (log_dir/worker-N), retido, métricas e
+# grupos: membros de um mesmo grupo em processos diferentes recebem cada um a
+# sua cópia.
+
+
+def _worker(index: int, paths: List[str], options: dict) -> None:
+    options = dict(options)
+    if options.get("log_dir"):
+        options["log_dir"] = os.path.join(options["log_dir"], f"worker-{index}")
+    if options.get("stats_file"):
+        options["stats_file"] = f"{options['stats_file']}.{index}"
+    broker = Broker(
+        reuse_port=True,
+        peer_path=paths[index],
+        peers=[p for i, p in enumerate(paths) if i != index],
+        node=f"worker-{index}",
+        **options,
+    )
+    broker.start()
+
+
+def run_workers(
+    workers: int, socket_dir: Optional[str] = None, **options: Any
+) -> List[multiprocessing.Process]:
+    # options vão para cada Broker (host, port, mode, ...); devolve os processos
+    if workers < 1:
+        raise ValueError("é preciso pelo menos um worker")
+    socket_dir = socket_dir or tempfile.mkdtemp(prefix="mom-")
+    paths = [os.path.join(socket_dir, f"worker-{i}.sock") for i in range(workers)]
+    procs = [
+        multiprocessing.Process(
+            target=_worker, args=(i, paths, options), name=f"worker-{i}", daemon=True
+        )
+        for i in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    return procs
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    p = argparse.ArgumentParser(description="broker em vários processos")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=5000)
+    p.add_argument("--mode", choices=Broker.MODES, default="threads")
+    p.add_argument("--consumers", type=int, default=1)
+    p.add_argument("--outbox-size", type=int, default=1000)
+    p.add_argument("--overflow", default="block")
+    p.add_argument("--passthrough", action="store_true")
+    p.add_argument("--log-dir", default=None)
+    p.add_argument("--socket-dir", default=None)
+    args = p.parse_args(argv)
+    procs = run_workers(
+        args.workers,
+        args.socket_dir,
+        host=args.host,
+        port=args.port,
+        mode=args.mode,
+        consumers=args.consumers,
+        outbox_size=args.outbox_size,
+        overflow=args.overflow,
+        passthrough=args.passthrough,
+        log_dir=args.log_dir,
+    )
+    try:
+        for proc in procs:
+            proc.join()
+    except KeyboardInterrupt:
+        for proc in procs:
+            proc.terminate()
+
+
+if __name__ == "__main__":
+    main()
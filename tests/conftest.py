@@ -0,0 +1,6 @@
+import os
+import sys
+
+# os módulos do mom se importam pelo nome (from codec import ...), como em
+# "python broker.py" rodado de dentro de mom/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "mom"))
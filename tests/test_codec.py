@@ -0,0 +1,136 @@
+import pytest
+
+from codec import (
+    BINARY_CODEC,
+    DEFAULT_CODEC,
+    decode_envelope,
+    encode_envelope,
+    get_codec,
+    transcode,
+)
+
+msgpack = get_codec("msgpack")
+
+
+def test_defaults():
+    assert DEFAULT_CODEC == "json"
+    assert get_codec(None).name == DEFAULT_CODEC
+    assert get_codec(BINARY_CODEC) is msgpack
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        None,
+        True,
+        False,
+        0,
+        127,
+        128,
+        255,
+        256,
+        65535,
+        65536,
+        2**32 - 1,
+        2**32,
+        2**64 - 1,
+        -1,
+        -32,
+        -33,
+        -128,
+        -129,
+        -32768,
+        -32769,
+        -(2**31),
+        -(2**31) - 1,
+        -(2**63),
+        0.0,
+        -1.5,
+        3.141592653589793,
+        "",
+        "a",
+        "x" * 31,
+        "x" * 32,
+        "x" * 255,
+        "x" * 256,
+        "x" * 65536,
+        "ção 🚗",
+        b"",
+        b"\x00\xff",
+        b"b" * 256,
+        b"b" * 65536,
+        [],
+        [1, "a", None],
+        list(range(15)),
+        list(range(16)),
+        list(range(65536)),
+        {},
+        {"a": 1},
+        {str(i): i for i in range(16)},
+        {1: "int key", "nested": {"list": [{"x": [True, None]}]}},
+    ],
+)
+def test_msgpack_round_trip(value):
+    assert msgpack.decode(msgpack.encode(value)) == value
+
+
+def test_msgpack_wire_format():
+    # bytes do formato MessagePack, iguais aos de outras implementações
+    assert msgpack.encode({"a": 1}) == b"\x81\xa1a\x01"
+    assert msgpack.encode([None, True, False]) == b"\x93\xc0\xc3\xc2"
+    assert msgpack.encode(-1) == b"\xff"
+    assert msgpack.encode(200) == b"\xcc\xc8"
+    assert msgpack.encode(1.5) == b"\xcb\x3f\xf8" + b"\x00" * 6
+    assert msgpack.encode(b"hi") == b"\xc4\x02hi"
+    # float32 não é gerado, mas é aceito
+    assert msgpack.decode(b"\xca\x3f\xc0\x00\x00") == 1.5
+
+
+def test_msgpack_tuple_encodes_as_array():
+    assert msgpack.decode(msgpack.encode((1, 2))) == [1, 2]
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        b"\xa5abc",
+        b"\xc4\x05ab",
+        b"\x92\x01",
+        b"\xcd\x01",
+        b"\x01\x02",
+        b"\xc1",
+        b"\x81\x90\x01",
+    ],
+)
+def test_msgpack_invalid(data):
+    with pytest.raises(ValueError):
+        msgpack.decode(data)
+
+
+def test_msgpack_unsupported_type():
+    with pytest.raises(TypeError):
+        msgpack.encode(object())
+
+
+@pytest.mark.parametrize("codec", ["json", "msgpack"])
+def test_envelope_round_trip(codec):
+    data = encode_envelope({"speed": 12.5, "ok": True}, {"vehicle": "v1"}, codec)
+    assert decode_envelope(data, codec) == {
+        "payload": {"speed": 12.5, "ok": True},
+        "headers": {"vehicle": "v1"},
+    }
+
+
+def test_envelope_must_be_a_map():
+    with pytest.raises(ValueError):
+        decode_envelope(msgpack.encode([1, 2]), "msgpack")
+
+
+def test_transcode_between_json_and_msgpack():
+    body = encode_envelope([1, "a"], None, "json")
+    data, codec = transcode(body, "json", "msgpack")
+    assert codec == "msgpack"
+    assert decode_envelope(data, "msgpack") == {"payload": [1, "a"], "headers": {}}
+    back, codec = transcode(data, "msgpack", "json")
+    assert (back, codec) == (body, "json")
@@ -0,0 +1,151 @@
+import pytest
+
+from framing import (
+    FLAG_ID,
+    HEADER,
+    OPCODES,
+    FrameReader,
+    encode_batch,
+    encode_frame,
+    iter_batch,
+    split_options,
+)
+
+
+def frames(reader: FrameReader) -> list:
+    return list(reader.frames())
+
+
+def test_text_frames_without_body():
+    r = FrameReader()
+    r.feed(b"SUB a.b\nSTATS\n")
+    assert frames(r) == [(["SUB", "a.b"], b""), (["STATS"], b"")]
+
+
+def test_body_split_across_feeds():
+    data = encode_frame("PUB", "t", b"0123456789")
+    r = FrameReader()
+    r.feed(data[:8])
+    assert frames(r) == []
+    r.feed(data[8:14])
+    assert frames(r) == []
+    r.feed(data[14:])
+    assert frames(r) == [(["PUB", "t", 10], b"0123456789")]
+
+
+def test_large_body_is_received_in_own_buffer_and_buffer_shrinks():
+    body = bytes(range(256)) * 4096  # 1 MiB, acima de LARGE_BODY
+    data = encode_frame("PUB", "t", body) + encode_frame("PUB", "u", b"x")
+    r = FrameReader()
+    for i in range(0, len(data), 65536):
+        r.feed(data[i : i + 65536])
+    assert frames(r) == [(["PUB", "t", len(body)], body), (["PUB", "u", 1], b"x")]
+    assert len(r._buf) == 4096
+
+
+def test_announced_size_above_limit_is_rejected_before_reading():
+    r = FrameReader()
+    r.feed(b"PUB a 900000000000\n")
+    with pytest.raises(ValueError):
+        frames(r)
+
+
+@pytest.mark.parametrize("line", [b"PUB a -9\n", b"PUB a nove\n", b"MPUB 1 -5\n"])
+def test_negative_or_non_numeric_size_is_rejected(line):
+    r = FrameReader()
+    r.feed(line)
+    with pytest.raises(ValueError):
+        frames(r)
+
+
+def test_line_too_long_is_rejected():
+    r = FrameReader()
+    r.feed(b"x" * (FrameReader.MAX_LINE + 1))
+    with pytest.raises(ValueError):
+        frames(r)
+
+
+def test_binary_header_with_codec_and_id():
+    r = FrameReader()
+    r.binary = True
+    data = encode_frame("MSG", "t", b"\x80", binary=True, codec="msgpack", msg_id=7)
+    r.feed(data[:3])
+    assert frames(r) == []
+    r.feed(data[3:])
+    assert frames(r) == [(["MSG", "t", 1, "msgpack", 7], b"\x80")]
+
+
+def test_binary_sub_options_travel_in_body():
+    r = FrameReader()
+    r.binary = True
+    r.feed(encode_frame("SUB", "a.#", b"qos=1 group=g", binary=True))
+    assert frames(r) == [(["SUB", "a.#", "qos=1", "group=g"], b"")]
+
+
+def test_binary_unknown_opcode_and_codec_are_rejected():
+    r = FrameReader()
+    r.binary = True
+    r.feed(HEADER.pack(99, 0, 0, 0))
+    with pytest.raises(ValueError):
+        frames(r)
+    r = FrameReader()
+    r.binary = True
+    r.feed(HEADER.pack(OPCODES["PUB"], 0x7F & ~FLAG_ID, 1, 0) + b"t")
+    with pytest.raises(ValueError):
+        frames(r)
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_batch_round_trip(binary):
+    items = [("a", b"1"), ("b.c", b""), ("d", b"x" * 300)]
+    data = encode_batch(items, binary=binary)
+    r = FrameReader()
+    r.binary = binary
+    r.feed(data)
+    [(parts, body)] = frames(r)
+    assert parts[0] == "MPUB"
+    assert list(iter_batch(body, binary=binary)) == items
+
+
+@pytest.mark.parametrize("body", [b"t -5\n", b"t 5\nabc", b"t x\n"])
+def test_invalid_batch_item_is_rejected(body):
+    with pytest.raises(ValueError):
+        list(iter_batch(body))
+
+
+def test_filter_option_keeps_whitespace_in_literals():
+    expr = 'name == "a  b" and  x > 1'
+    r = FrameReader()
+    r.feed(f"SUB v.1 qos=1 filter={expr}\n".encode("utf-8"))
+    assert frames(r) == [(["SUB", "v.1", "qos=1", f"filter={expr}"], b"")]
+    r = FrameReader()
+    r.binary = True
+    r.feed(encode_frame("SUB", "v.1", f"filter={expr}".encode("utf-8"), binary=True))
+    assert frames(r) == [(["SUB", "v.1", f"filter={expr}"], b"")]
+
+
+def test_split_options():
+    assert split_options("qos=1  group=g") == ["qos=1", "group=g"]
+    assert split_options("conflate=id FILTER=a == 'x  y'") == [
+        "conflate=id",
+        "FILTER=a == 'x  y'",
+    ]
+
+
+def test_text_and_binary_fields_have_the_same_types():
+    text = FrameReader()
+    text.feed(encode_frame("CHUNK", "t", b"ab", codec="msgpack", msg_id=2**40 + 5))
+    binary = FrameReader()
+    binary.binary = True
+    binary.feed(encode_frame("CHUNK", "t", b"ab", True, "msgpack", 2**40 + 5))
+    expected = [(["CHUNK", "t", 2, "msgpack", 2**40 + 5], b"ab")]
+    assert frames(text) == expected
+    assert frames(binary) == expected
+
+
+@pytest.mark.parametrize("line", [b"PUB t 1 nope\nx", b"MSG t 1 json x\ny"])
+def test_text_rejects_unknown_codec_or_bad_id(line):
+    r = FrameReader()
+    r.feed(line)
+    with pytest.raises(ValueError):
+        frames(r)